@@ -0,0 +1,103 @@
+'''
+Thread engine vs asyncio engine.
+Runs N downloads at once (bypass through the proxy pool, then the transfer) against
+bench/fake_server.py and reports, per engine and N: peak thread count, peak RSS
+and throughput. Every run is a fresh process so the memory numbers do not mix.
+
+Usage: python bench/asyncio_engine.py [file size in KB] [N ...]
+Defaults: 256 KB files, N = 10 100 1000.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import threading
+import subprocess
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH, '..', 'src'))
+
+def run(engine, n, port, size, directory):
+    import download
+    from cli import HeadlessWorker
+    from proxies import POOL
+    from scheduler import Scheduler
+
+    base = f'http://127.0.0.1:{port}'
+    download.SEGMENTS = 1
+    POOL.api = f'{base}/proxies'
+    POOL.check_url = f'{base}/'
+    POOL.refill()
+
+    peak = [threading.active_count()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.05):
+            peak[0] = max(peak[0], threading.active_count())
+
+    threading.Thread(target=sample, daemon=True).start()
+
+    if engine == 'asyncio':
+        from aio import AsyncEngine
+        scheduler = Scheduler(None, max_active=n, max_bypassing=n)
+        scheduler.start = AsyncEngine(scheduler).start
+    else:
+        scheduler = Scheduler(lambda job: threading.Thread(target=job.run, daemon=True).start(),
+                              max_active=n, max_bypassing=n)
+
+    jobs = []
+    for i in range(n):
+        job = HeadlessWorker(f'{base}/?f{i}-{size}', directory, f'f{i}', '')
+        job.scheduler = scheduler
+        jobs.append(job)
+
+    start = time.perf_counter()
+    for job in jobs:
+        scheduler.submit(job)
+    while not all(job.done for job in jobs):
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    done.set()
+
+    complete = sum(job.complete() for job in jobs)
+    return {
+        'engine': engine, 'n': n, 'complete': complete,
+        'threads': peak[0],
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'seconds': elapsed,
+        'mb_s': complete * size / elapsed / 1024 / 1024,
+    }
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 256 * 1024
+    counts = [int(n) for n in sys.argv[2:]] or [10, 100, 1000]
+
+    server = subprocess.Popen([sys.executable, os.path.join(BENCH, 'fake_server.py')],
+                              stdout=subprocess.PIPE, text=True)
+    port = int(server.stdout.readline())
+    print(f'{"engine":>8} {"N":>5} {"done":>5} {"threads":>8} {"RSS MB":>8} {"seconds":>8} {"MB/s":>8}')
+    try:
+        for n in counts:
+            for engine in ('threads', 'asyncio'):
+                directory = tempfile.mkdtemp()
+                try:
+                    out = subprocess.run([sys.executable, __file__, '--run', engine, str(n), str(port),
+                                          str(size), directory], capture_output=True, text=True, check=True)
+                finally:
+                    shutil.rmtree(directory)
+                r = json.loads(out.stdout.splitlines()[-1])
+                print(f'{r["engine"]:>8} {r["n"]:>5} {r["complete"]:>5} {r["threads"]:>8} '
+                      f'{r["rss_mb"]:>8.1f} {r["seconds"]:>8.2f} {r["mb_s"]:>8.1f}', flush=True)
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        engine, n, port, size, directory = sys.argv[2:7]
+        print(json.dumps(run(engine, int(n), int(port), int(size), directory)))
+    else:
+        main()
@@ -0,0 +1,202 @@
+'''
+Local stand-in for 1fichier, used by the benchmarks.
+Serves:
+  GET  /?<id>              file page with the td.normal cells get_link_info reads,
+                           or the #pass form for ids starting with 'pw'
+  POST /?<id>              page with the /html/body/div[4]/div[2]/a direct link
+                           (password protected ids: the #pass form, then 'Bad password' unless pass=PASSWORD)
+  GET  /file/<id>          the file itself, Content-Disposition and Range support
+  GET  /dir/<id>?json=1    folder listing, <id> = <name>-<files>-<size>
+  GET  /proxies            proxy list, one bare host:port per line like the real API: this server
+                           itself, plus --dead addresses that refuse connections
+It also acts as a plain HTTP forward proxy, so the proxy pool and the bypass
+go through it like through a real proxy. With --flaky a share of the proxied
+requests is dropped without an answer.
+Every path is also served under /1fichier.com, for clients that only take 1fichier links
+(e.g. http://127.0.0.1:<port>/1fichier.com/dir/f-10-1048576).
+Files are <size> bytes of a fixed pattern, `size` being the id's number after the first '-'
+(e.g. /?big-1073741824), or the default size.
+
+Usage: python bench/fake_server.py [port] [default size] [--rate KB/s] [--latency ms] [--flaky share] [--dead n]
+Prints the port it listens on.
+'''
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PATTERN = bytes(range(256)) * 4096
+PASSWORD = 'secret'
+# Optional path prefix that makes local links look like 1fichier links.
+MOUNT = '/1fichier.com'
+# Bytes per paced write when the bandwidth is capped.
+PACE_SIZE = 16 * 1024
+
+def file_size(file_id, default):
+    size = file_id.split('-')[1] if '-' in file_id else ''
+    return int(size) if size.isdigit() else default
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    default_size = 64 * 1024 * 1024
+    # Bytes/s per file connection (None = unlimited), seconds before every answer.
+    rate = None
+    latency = 0
+    # Share of proxied requests dropped, dead proxies listed, seeded so runs repeat.
+    flaky = 0
+    dead = 0
+    random = random.Random(1)
+    random_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def route(self):
+        # Requests through the proxy carry absolute URLs.
+        url = urlsplit(self.path)
+        return url.path.removeprefix(MOUNT) or '/', url.query
+
+    def proxied(self):
+        return self.path.startswith('http')
+
+    def drop(self):
+        '''
+        True (and the connection closed unanswered) for the --flaky share of proxied requests.
+        '''
+        if not self.flaky or not self.proxied():
+            return False
+        with self.random_lock:
+            dropped = self.random.random() < self.flaky
+        if dropped:
+            self.close_connection = True
+        return dropped
+
+    def send_response(self, code, message=None):
+        if self.latency:
+            time.sleep(self.latency)
+        super().send_response(code, message)
+
+    def send_body(self, body, content_type='text/html'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def base(self):
+        return f'http://{self.headers["Host"]}'
+
+    def file_page(self, file_id):
+        if file_id.startswith('pw'):
+            return self.password_page()
+        size = file_size(file_id, self.default_size)
+        return (f'<html><body><table><tr><td class="normal">{file_id}.bin</td>'
+                f'<td class="normal">Date</td><td class="normal">{size} B</td></tr></table></body></html>').encode()
+
+    def password_page(self):
+        return b'<html><body><form method="post"><input type="password" id="pass" name="pass"></form></body></html>'
+
+    def link_page(self, file_id):
+        return (f'<html><body><div></div><div></div><div></div><div><div></div>'
+                f'<div><a href="{self.base()}/file/{file_id}">Download</a></div></div></body></html>').encode()
+
+    def folder(self, folder_id):
+        name, files, size = (folder_id.split('-') + ['1', str(self.default_size)])[:3]
+        return json.dumps([{'link': f'{self.base()}/?{name}{i}-{size}', 'filename': f'{name}{i}-{size}.bin',
+                            'size': int(size), 'password': 1 if name.startswith('pw') else 0}
+                           for i in range(int(files))]).encode()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if self.drop():
+            return
+        path, query = self.route()
+        if path == '/proxies':
+            # Ports below 10 refuse connections.
+            dead = ''.join(f'127.0.0.1:{port}\n' for port in range(1, self.dead + 1))
+            return self.send_body(f'{self.headers["Host"]}\n{dead}'.encode(), 'text/plain')
+        if path.startswith('/file/'):
+            return self.send_file(path[6:])
+        if path.startswith('/dir/'):
+            return self.send_body(self.folder(path[5:]), 'application/json')
+        self.send_body(self.file_page(query))
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        if self.drop():
+            return
+        path, query = self.route()
+        if query.startswith('pw'):
+            if 'pass' not in form:
+                return self.send_body(self.password_page())
+            if form['pass'] != [PASSWORD]:
+                return self.send_body(b'<html><body><div>Bad password</div></body></html>')
+        self.send_body(self.link_page(query))
+
+    def send_file(self, file_id):
+        size = file_size(file_id, self.default_size)
+        start, end = 0, size - 1
+        ranged = self.headers.get('Range', '').startswith('bytes=')
+        if ranged:
+            first, last = self.headers['Range'][6:].split('-')
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        self.send_response(206 if ranged else 200)
+        self.send_header('Content-Disposition', f'attachment; filename="{file_id}.bin"')
+        self.send_header('Content-Length', str(end - start + 1))
+        if ranged:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        view = memoryview(PATTERN)
+        position = start
+        began = time.monotonic()
+        try:
+            while position <= end:
+                offset = position % 256
+                n = min(len(PATTERN) - offset, end - position + 1)
+                if self.rate:
+                    n = min(n, PACE_SIZE)
+                self.wfile.write(view[offset:offset + n])
+                position += n
+                if self.rate:
+                    ahead = (position - start) / self.rate - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def serve(port=0, default_size=None, rate=None, latency=0, flaky=0, dead=0):
+    if default_size:
+        FakeHandler.default_size = default_size
+    FakeHandler.rate = rate
+    FakeHandler.latency = latency
+    FakeHandler.flaky = flaky
+    FakeHandler.dead = dead
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeHandler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('port', nargs='?', type=int, default=0)
+    parser.add_argument('size', nargs='?', type=int)
+    parser.add_argument('--rate', type=int, default=0, help='KB/s per file connection (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0, help='ms before every answer')
+    parser.add_argument('--flaky', type=float, default=0, help='share of proxied requests dropped')
+    parser.add_argument('--dead', type=int, default=0, help='dead proxies added to the list (at most 9)')
+    args = parser.parse_args()
+    server = serve(args.port, args.size, args.rate * 1024 or None, args.latency / 1000, args.flaky, min(args.dead, 9))
+    print(server.server_port, flush=True)
+    server.serve_forever()
@@ -0,0 +1,138 @@
+'''
+End-to-end scenarios against bench/fake_server.py.
+Every scenario starts its own server (bandwidth, latency, flaky proxies) and runs
+the headless client on a folder link in a fresh process, with fresh state, then reports:
+files done, wall time, throughput, CPU time and use, peak RSS, mean time to first
+byte and retries (from the client's --metrics-json dump).
+Results can be saved and later runs compared against them, so a change shows
+its effect on every scenario.
+
+Usage: python bench/scenarios.py [scenario ...] [--engine threads|asyncio] [--scale F]
+                                 [--save FILE] [--baseline FILE]
+Defaults: every scenario, threads engine, full size.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+CLIENT = os.path.join(BENCH, '..', 'src', '1fichier-dl.py')
+SERVER = os.path.join(BENCH, 'fake_server.py')
+KB = 1024
+MB = 1024 * KB
+PASSWORD = 'secret'
+
+# name: (description, fake_server options, files, file size, client options)
+SCENARIOS = {
+    'huge': ('one 1 GB file, segmented', [], 1, 1024 * MB, []),
+    'many': ('200 files of 256 KB, 20 at once', [], 200, 256 * KB, ['-j', '20']),
+    'flaky': ('20 password protected 4 MB files, 30% of proxied requests dropped, 3 dead proxies',
+              ['--flaky', '0.3', '--dead', '3'], 20, 4 * MB, ['-j', '5', '-p', PASSWORD]),
+    'slow': ('4 files of 16 MB at 2 MB/s per connection, 50 ms latency',
+             ['--rate', '2048', '--latency', '50'], 4, 16 * MB, ['-j', '4']),
+}
+# Reported columns: (key, header, decimals).
+COLUMNS = [
+    ('done', 'done', 0),
+    ('seconds', 'seconds', 2),
+    ('mb_s', 'MB/s', 1),
+    ('cpu', 'CPU s', 2),
+    ('cpu_pct', 'CPU %', 0),
+    ('rss_mb', 'RSS MB', 1),
+    ('ttfb_ms', 'TTFB ms', 1),
+    ('retries', 'retries', 0),
+]
+
+def start_server(options):
+    server = subprocess.Popen([sys.executable, SERVER] + options, stdout=subprocess.PIPE, text=True)
+    return server, int(server.stdout.readline())
+
+def run(name, engine, scale):
+    description, server_options, files, size, client_options = SCENARIOS[name]
+    size = max(int(size * scale), 1)
+    server, port = start_server(server_options)
+    base = f'http://127.0.0.1:{port}'
+    # The client only takes 1fichier links, the server answers under this prefix too.
+    folder_link = f'{base}/1fichier.com/dir/{"pw" if "-p" in client_options else "f"}-{files}-{size}'
+    work = tempfile.mkdtemp()
+    try:
+        metrics_path = os.path.join(work, 'metrics.json')
+        command = [sys.executable, CLIENT, folder_link, '-o', os.path.join(work, 'out'),
+                   '--state', os.path.join(work, 'state'), '--proxy-list', f'{base}/proxies',
+                   '--proxy-check', f'{base}/', '--engine', engine, '--metrics-json', metrics_path] + client_options
+        start = time.perf_counter()
+        client = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        # wait4 gives the CPU time and peak RSS of this client only.
+        _, status, usage = os.wait4(client.pid, 0)
+        seconds = time.perf_counter() - start
+        errors = client.stderr.read()
+        client.stderr.close()
+        if not os.path.exists(metrics_path):
+            raise RuntimeError(f'{name}: client failed\n{errors}')
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work)
+
+    counters = {}
+    for c in metrics['counters']:
+        counters[c['name']] = counters.get(c['name'], 0) + c['value']
+    ttfb = next((s for s in metrics['spans'] if s['name'] == 'ttfb'), None)
+    cpu = usage.ru_utime + usage.ru_stime
+    return {
+        'scenario': name, 'engine': engine, 'description': description,
+        'done': counters.get('downloads', 0),
+        'seconds': seconds,
+        'mb_s': counters.get('bytes', 0) / seconds / MB,
+        'cpu': cpu,
+        'cpu_pct': 100 * cpu / seconds,
+        'rss_mb': usage.ru_maxrss / 1024,
+        'ttfb_ms': 1000 * ttfb['seconds'] / ttfb['count'] if ttfb else 0,
+        'retries': counters.get('retries', 0),
+    }
+
+def delta(result, base, key):
+    if not base.get(key):
+        return f'{"-":>9}'
+    return f'{100 * (result[key] - base[key]) / base[key]:>+8.1f}%'
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks against a local fake 1fichier.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=', '.join(SCENARIOS))
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads')
+    parser.add_argument('--scale', type=float, default=1, help='multiply every file size by F')
+    parser.add_argument('--save', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare with results saved by --save')
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenario: {", ".join(sorted(unknown))}')
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r['scenario']: r for r in json.load(f)}
+
+    print(f'{"scenario":>9}' + ''.join(f'{header:>9}' for _, header, _ in COLUMNS))
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        result = run(name, args.engine, args.scale)
+        results.append(result)
+        print(f'{name:>9}' + ''.join(f'{result[key]:>9.{decimals}f}' for key, _, decimals in COLUMNS), flush=True)
+        if name in baseline:
+            # Change against the baseline, lower is better except for done and MB/s.
+            print(f'{"vs base":>9}' + ''.join(delta(result, baseline[name], key) for key, _, _ in COLUMNS), flush=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+'''
+Connection reuse benchmark.
+Sends the same small requests to a local HTTP server with the module-level
+requests.get (one connection per call) and with the shared sessions layer,
+reporting connections opened and mean latency for each.
+Every new connection is delayed by a simulated handshake, standing in for the
+TCP+TLS setup a real 1fichier request pays.
+
+Usage: python bench/sessions.py [requests] [handshake ms]
+'''
+import os
+import sys
+import time
+import socket
+import threading
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import sessions
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    handshake = 0
+    connections = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes, don't let Nagle hold the body back.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with PageHandler.lock:
+            PageHandler.connections += 1
+        time.sleep(self.handshake)
+
+    def do_GET(self):
+        body = b'<html><body><table><tr><td class="normal">file</td></tr></table></body></html>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def measure(name, get, url, count):
+    PageHandler.connections = 0
+    start = time.perf_counter()
+    for i in range(count):
+        get(f'{url}?{i}').content
+    elapsed = time.perf_counter() - start
+    print(f'{name:<10} {PageHandler.connections:6d} connections {1000 * elapsed / count:8.2f} ms/request')
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    PageHandler.handshake = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+
+    print(f'{count} requests, {PageHandler.handshake * 1000:.0f} ms handshake')
+    measure('requests', requests.get, url, count)
+    measure('sessions', sessions.get, url, count)
+    server.shutdown()
@@ -0,0 +1,108 @@
+'''
+GUI startup benchmark.
+Copies src to a temporary directory with a journal of N downloads (and their
+metadata, so restoring them needs no request), then launches the GUI in fresh
+processes (offscreen) and reports, in seconds since launch: modules imported,
+window shown and every download back in the table. The first launch has no
+bytecode cache yet, the others do. The window time is checked against
+gui.STARTUP_BUDGET.
+
+Usage: python bench/startup.py [downloads] [runs]
+'''
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import statistics
+import tempfile
+import subprocess
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(BENCH, '..', 'src')
+
+# Runs in the launched process: times the startup and quits once every download is restored.
+CHILD = '''
+import os, sys, json, time
+started = time.perf_counter()
+sys.path.insert(0, {src!r})
+import gui
+marks = {{'import': time.perf_counter() - started}}
+shown = gui.Gui.shown
+
+def finish():
+    marks['restored'] = time.perf_counter() - started
+    print(json.dumps(dict(marks, budget=gui.STARTUP_BUDGET)), flush=True)
+    os._exit(0)
+
+def timed_shown(self):
+    marks['window'] = time.perf_counter() - started
+    shown(self)
+    timer = gui.QTimer()
+    timer.timeout.connect(lambda: self.table_model.rowCount() >= {downloads} and finish())
+    timer.start(5)
+    self.bench_timer = timer
+
+gui.Gui.shown = timed_shown
+gui.Gui(started)
+'''
+
+def prepare(work, downloads):
+    '''
+    Copy of src with an app directory holding `downloads` journal rows and their metadata.
+    '''
+    src = os.path.join(work, 'src')
+    shutil.copytree(SRC, src, ignore=shutil.ignore_patterns('app', '__pycache__'))
+    sys.path.insert(0, src)
+    from journal import Journal
+    from metadata import MetadataCache
+    app = os.path.join(src, 'app')
+    journal = Journal(os.path.join(app, 'journal.db'))
+    journal.open()
+    metadata = MetadataCache()
+    metadata.path = os.path.join(app, 'metadata')
+    for i in range(downloads):
+        link = f'https://1fichier.com/?bench{i:06d}'
+        journal.put([link, None, None, 0, None, None])
+        metadata.put(link, [f'file{i:06d}.bin', '1.0 GB'])
+    journal.close()
+    metadata.save()
+    with open(os.path.join(app, 'settings'), 'wb') as f:
+        # One download at a time, into the work directory.
+        pickle.dump([os.path.join(work, 'downloads'), 1, 0], f)
+    return src
+
+def launch(src, downloads):
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    start = time.perf_counter()
+    child = subprocess.run([sys.executable, '-c', CHILD.format(src=src, downloads=downloads)],
+                           env=env, capture_output=True, text=True, timeout=120)
+    # Interpreter startup is only seen from here.
+    offset = time.perf_counter() - start
+    marks = json.loads(child.stdout.splitlines()[-1])
+    offset -= marks['restored']
+    return {key: value + offset if key != 'budget' else value for key, value in marks.items()}
+
+def main():
+    downloads = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    work = tempfile.mkdtemp()
+    try:
+        src = prepare(work, downloads)
+        results = [launch(src, downloads) for _ in range(runs + 1)]
+    finally:
+        shutil.rmtree(work)
+
+    print(f'{downloads} downloads restored, seconds since launch')
+    print(f'{"":>14} {"imported":>9} {"window":>9} {"restored":>9}')
+    for label, marks in (('first launch', results[0]),
+                         (f'median of {runs}', {key: statistics.median(r[key] for r in results[1:])
+                                                for key in results[0]})):
+        print(f'{label:>14} {marks["import"]:>9.3f} {marks["window"]:>9.3f} {marks["restored"]:>9.3f}')
+    budget = results[0]['budget']
+    slowest = max(r['window'] for r in results)
+    print(f'window budget {budget} s: {"met" if slowest <= budget else "missed"} (slowest {slowest:.3f} s)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+'''
+Download table with N rows: QStandardItem cells and a QProgressBar widget per row
+(the old table) against model.DownloadTableModel with the painted progress column.
+Reports the time to add the rows, to apply one progress tick touching every row,
+to scroll through the whole table, and the memory the rows take.
+
+Usage: QT_QPA_PLATFORM=offscreen python bench/table_model.py [rows]
+'''
+import os
+import sys
+import time
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+def run(kind, n):
+    from PyQt5.QtWidgets import QApplication, QTableView, QProgressBar
+    from PyQt5.QtGui import QStandardItemModel, QStandardItem
+    from model import DownloadTableModel, DownloadRecord, ProgressDelegate, PROGRESS_COLUMN, COLUMNS
+
+    app = QApplication(sys.argv)
+    table = QTableView()
+    table.resize(670, 415)
+    table.show()
+    app.processEvents()
+    base = rss_mb()
+
+    start = time.perf_counter()
+    if kind == 'old':
+        model = QStandardItemModel()
+        model.setHorizontalHeaderLabels(COLUMNS)
+        table.setModel(model)
+        bars = []
+        for i in range(n):
+            row = [QStandardItem(v) for v in (f'file{i}.bin', '1.0 GB', 'Queued', '0 B/s', '', 'No password')]
+            model.appendRow(row)
+            bar = QProgressBar()
+            table.setIndexWidget(model.index(model.rowCount() - 1, 4), bar)
+            bars.append((row, bar))
+    else:
+        model = DownloadTableModel()
+        table.setModel(model)
+        table.setItemDelegateForColumn(PROGRESS_COLUMN, ProgressDelegate(table))
+        records = []
+        for i in range(n):
+            record = DownloadRecord(f'file{i}.bin', '1.0 GB')
+            model.append(record)
+            records.append(record)
+    app.processEvents()
+    add = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if kind == 'old':
+        for row, bar in bars:
+            row[2].setText('Downloading')
+            row[3].setText('1.0 MB/s')
+            bar.setValue(50)
+    else:
+        for record in records:
+            record.status = 'Downloading'
+            record.speed = '1.0 MB/s'
+            record.percent = 50
+        model.refresh(records)
+    app.processEvents()
+    tick = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bar = table.verticalScrollBar()
+    for value in range(0, bar.maximum() + 1, max(1, bar.pageStep())):
+        bar.setValue(value)
+        table.viewport().repaint()
+    scroll = time.perf_counter() - start
+    return add, tick, scroll, rss_mb() - base
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        print(*run(sys.argv[2], int(sys.argv[3])))
+        sys.exit()
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f'{"table":>6} {"rows":>6} {"add s":>8} {"tick s":>8} {"scroll s":>9} {"rows MB":>8}')
+    for kind in ('old', 'model'):
+        out = subprocess.run([sys.executable, __file__, '--run', kind, str(n)],
+                             capture_output=True, text=True, check=True).stdout.split()
+        add, tick, scroll, mem = map(float, out[-4:])
+        print(f'{kind:>6} {n:>6} {add:>8.2f} {tick:>8.3f} {scroll:>9.2f} {mem:>8.1f}')
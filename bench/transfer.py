@@ -0,0 +1,95 @@
+'''
+Transfer microbenchmark.
+Serves an in-memory file from a local HTTP server and downloads it with the
+old 1 KiB iter_content loop and with download.transfer, reporting throughput
+and CPU time per GB for each.
+
+Usage: python bench/transfer.py [size in MB] [runs]
+'''
+import os
+import math
+import sys
+import time
+import tempfile
+import threading
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import download
+
+PAYLOAD = os.urandom(1024 * 1024)
+
+class FileHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    size = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(self.size))
+        self.end_headers()
+        sent = 0
+        while sent < self.size:
+            n = min(len(PAYLOAD), self.size - sent)
+            self.wfile.write(PAYLOAD[:n])
+            sent += n
+
+class Worker:
+    stopped = paused = False
+    scheduler = None
+    hasher = None
+
+def legacy_speed(bytes_read, start_time):
+    # download.download_speed as it was called once per chunk.
+    if time.time() - start_time == 0:
+        return '- B/s'
+    bps = bytes_read / (time.time() - start_time)
+    i = int(math.floor(math.log(bps, 1024)))
+    return '%s %s' % (round(bps / math.pow(1024, i), 2), i)
+
+def legacy(r, f):
+    # The loop download.download used before: one write and one progress update per KiB.
+    bytes_read = 0
+    start = time.time()
+    for chunk in r.iter_content(1024):
+        f.write(chunk)
+        bytes_read += len(chunk)
+        total_per = 100 * float(bytes_read) / float(r.headers['Content-Length'])
+        legacy_speed(bytes_read, start)
+
+def engine(r, f):
+    download.transfer(Worker(), r, f)
+
+def measure(name, copy, url, runs):
+    best = None
+    for _ in range(runs):
+        with tempfile.TemporaryFile() as f:
+            r = requests.get(url, stream=True)
+            size = int(r.headers['Content-Length'])
+            wall, cpu = time.perf_counter(), time.process_time()
+            copy(r, f)
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            r.close()
+        if best is None or wall < best[0]:
+            best = (wall, cpu)
+    wall, cpu = best
+    gb = size / 1024 ** 3
+    print(f'{name:<8} {size / wall / 1024 ** 2:10.1f} MB/s {cpu / gb:10.2f} CPU s/GB')
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    FileHandler.size = size * 1024 * 1024
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/file'
+
+    # The server thread shares this process, so CPU figures include serving the file.
+    print(f'{size} MB, best of {runs}')
+    measure('legacy', legacy, url, runs)
+    measure('engine', engine, url, runs)
+    server.shutdown()
@@ -1,4 +1,12 @@
-from gui import Gui
+import sys
+import time
 
 if __name__ == '__main__':
-    Gui()
\ No newline at end of file
+    started = time.perf_counter()
+    if len(sys.argv) > 1:
+        # Any argument means headless mode, PyQt5 is never imported.
+        from cli import main
+        sys.exit(main())
+    else:
+        from gui import Gui
+        Gui(started)
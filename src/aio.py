@@ -0,0 +1,348 @@
+import time
+import asyncio
+import threading
+import aiohttp
+import download
+import pages
+from urllib.parse import urlsplit
+from download import (USER_AGENT, PAYLOAD, BUFFER_SIZE, convert_size, check_index, served_from, content_length,
+                      write_at, proxy_limit, settled, relayed, resume_position, check_response, prepare_file, finish)
+from proxies import POOL
+from metrics import METRICS
+from retry import BREAKERS, Retry, Retryable
+from scheduler import MAX_BYPASSING
+
+# Connections the shared session keeps open in total, bytes read per await.
+CONNECTIONS = 100
+READ_SIZE = 256 * 1024
+
+def proxy_url(address):
+    # aiohttp tunnels HTTPS through plain HTTP proxies (CONNECT).
+    return address if '://' in address else f'http://{address}'
+
+def write_buffer(hasher, f, buf, offset, position):
+    '''
+    Runs on the default executor: disk writes and hashing would stall every download on the loop.
+    '''
+    if offset is None:
+        f.write(buf)
+    else:
+        write_at(f, buf, position)
+    if hasher:
+        hasher.update(buf, position)
+
+class AsyncEngine:
+    '''
+    Runs downloads as coroutines on one event loop in a background thread,
+    so waiting, bypassing and transferring downloads cost no thread each.
+    Jobs have the attributes download.download expects plus finish(), called
+    once their download returns. start() plugs into a Scheduler.
+    '''
+    def __init__(self, scheduler=None, connections=CONNECTIONS):
+        self.scheduler = scheduler
+        self.connections = connections
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        threading.Thread(target=self.run_loop, args=(ready,), daemon=True).start()
+        ready.wait()
+
+    def run_loop(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.open())
+        ready.set()
+        self.loop.run_forever()
+
+    async def open(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.connections),
+            headers={'User-Agent': USER_AGENT},
+            timeout=aiohttp.ClientTimeout(sock_connect=10, sock_read=30))
+        self.bypass_slots = asyncio.Semaphore(self.scheduler.max_bypassing if self.scheduler else MAX_BYPASSING)
+
+    def start(self, job):
+        asyncio.run_coroutine_threadsafe(self.run_job(job), self.loop)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def run_job(self, job):
+        task = asyncio.current_task()
+        try:
+            # Pausing or stopping cancels the job wherever it waits.
+            with job.control.on_halt(lambda: self.loop.call_soon_threadsafe(task.cancel)):
+                await self.download(job)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            job.progress.set(status=f'Failed ({e})')
+        job.finish()
+
+    async def bypass_attempt(self, url, payload, proxy, password):
+        timeout = aiohttp.ClientTimeout(sock_connect=download.BYPASS_TIMEOUT[0],
+                                        sock_read=download.BYPASS_TIMEOUT[1])
+        try:
+            t = time.monotonic()
+            with METRICS.span('bypass_post'):
+                async with self.session.post(url, data=payload, proxy=proxy_url(proxy), timeout=timeout) as r:
+                    content = await r.read()
+            latency = time.monotonic() - t
+            asked = pages.password_form(content)
+            if asked:
+                with METRICS.span('bypass_post'):
+                    async with self.session.post(url, data=dict(payload, **{'pass': password}),
+                                                 proxy=proxy_url(proxy), timeout=timeout) as r:
+                        content = await r.read()
+            with METRICS.span('parse'):
+                link = pages.direct_link(content)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Proxy failed.
+            POOL.report(proxy, False)
+            return None
+        text = content.decode(errors='replace')
+        cooldown = proxy_limit(r.status, text) if link is None else None
+        if not relayed(text, link, asked, cooldown):
+            POOL.report(proxy, False)
+            return None
+        POOL.report(proxy, True, latency)
+        if cooldown is not None:
+            BREAKERS.failure(proxy, cooldown)
+            METRICS.inc('proxy_limited')
+            return None
+        return text, link
+
+    async def race_bypass(self, job, url, payload, password, attempts):
+        '''
+        Same race as download.race_bypass, the losing attempts are really cancelled here.
+        '''
+        addresses = []
+        for _ in range(attempts):
+            try:
+                # Only blocks when the pool has to refill, keep that off the loop.
+                addresses.append(await self.loop.run_in_executor(None, POOL.get, list(addresses)))
+            except LookupError:
+                break
+        if not addresses:
+            return None, 1
+
+        tasks = [asyncio.ensure_future(self.bypass_attempt(url, payload, a, password)) for a in addresses]
+        winner = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result and settled(*result):
+                    winner = result
+                    break
+                if job.stopped or job.paused:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        return winner, len(addresses)
+
+    async def transfer(self, job, r, f, length=None, on_write=None, offset=None):
+        start = time.perf_counter()
+        buf = bytearray()
+        written = 0
+        flushed = time.monotonic()
+        try:
+            while not (job.stopped or job.paused):
+                want = READ_SIZE if length is None else min(READ_SIZE, length - written - len(buf))
+                if want <= 0:
+                    break
+                chunk = await r.content.read(want)
+                if not chunk:
+                    break
+                buf += chunk
+                if self.scheduler:
+                    wait = self.scheduler.delay(job, len(chunk))
+                    if wait:
+                        await asyncio.sleep(wait)
+                # Flushed per BUFFER_SIZE, or per PROGRESS_INTERVAL so progress moves on slow links.
+                if len(buf) >= BUFFER_SIZE or time.monotonic() - flushed > download.PROGRESS_INTERVAL:
+                    written += await self.write(job, f, buf, offset, written, on_write)
+                    buf = bytearray()
+                    flushed = time.monotonic()
+        finally:
+            # Also when cancelled, so a paused download keeps what it received.
+            if buf:
+                written += await asyncio.shield(self.write(job, f, buf, offset, written, on_write))
+        METRICS.observe('transfer', time.perf_counter() - start)
+        return written
+
+    async def write(self, job, f, buf, offset, written, on_write):
+        position = f.tell() if offset is None else offset + written
+        t = time.perf_counter()
+        await self.loop.run_in_executor(None, write_buffer, job.hasher, f, buf, offset, position)
+        METRICS.observe('disk_write', time.perf_counter() - t)
+        METRICS.inc('bytes', len(buf))
+        on_write(len(buf))
+        return len(buf)
+
+    async def fetch_segment(self, job, url, headers, segment, path, r=None):
+        '''
+        `r` may be an already opened response starting at the segment's resume position.
+        '''
+        def on_write(n):
+            segment[2] += n
+            job.progress.downloaded += n
+
+        try:
+            if r is None:
+                headers = dict(headers, Range=f'bytes={segment[0] + segment[2]}-{segment[1] - 1}')
+                with METRICS.span('ttfb'):
+                    r = await self.session.get(url, headers=headers)
+                r.raise_for_status()
+            if not served_from(r.status, r.headers, segment[0] + segment[2]):
+                raise Retryable('network')
+            with open(path, 'r+b') as f:
+                await self.transfer(job, r, f, segment[1] - segment[0] - segment[2], on_write,
+                                    segment[0] + segment[2])
+            if job.hasher:
+                job.hasher.catch_up(path, job.segments)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Segment failed, it stays unfinished in the progress map.
+            pass
+        finally:
+            if r is not None:
+                r.release()
+
+    async def fetch(self, job, referer, url):
+        '''
+        Download the file behind a direct link, like download.fetch.
+        Returns True once it is complete (or already was), False when paused or stopped.
+        Raises Retryable when the link has to be bypassed again.
+        '''
+        downloaded_size = resume_position(job)
+        headers = {'User-Agent': USER_AGENT, 'Referer': referer, 'Range': f'bytes={downloaded_size}-'}
+
+        host = urlsplit(url).hostname
+        if not BREAKERS.allow(host):
+            raise Retryable('network', BREAKERS.remaining(host))
+        try:
+            with METRICS.span('ttfb'):
+                r = await self.session.get(url, headers=headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            BREAKERS.failure(host)
+            raise Retryable('network')
+        async with r:
+            check_response(host, r.status, r.headers, downloaded_size)
+            # Reserving creates the file, and may list the directory.
+            path = await self.loop.run_in_executor(None, prepare_file, job, r.status, r.headers, downloaded_size)
+            if path is None:
+                return True
+            name = job.dl_name
+
+            if not job.segments:
+                # None for a chunked response, the body is then read to its end.
+                length = content_length(r.headers)
+                job.progress.set(name=name[:-11], status='Downloading')
+                if length is not None:
+                    job.progress.set(size=convert_size(length + downloaded_size))
+                job.progress.total = length + downloaded_size if length is not None else 0
+                job.progress.downloaded = downloaded_size
+
+                def on_write(n):
+                    job.progress.downloaded += n
+
+                if job.hasher:
+                    await self.loop.run_in_executor(None, lambda: job.hasher.catch_up(path, end=downloaded_size))
+                with open(path, 'ab') as f:
+                    try:
+                        written = await self.transfer(job, r, f, on_write=on_write)
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        written = None
+                if job.stopped or job.paused:
+                    return False
+                if written is None or length is not None and written != length:
+                    # Cut off, the next try appends the rest.
+                    BREAKERS.failure(host)
+                    raise Retryable('network')
+                job.progress.total = job.progress.downloaded
+            else:
+                job.progress.set(name=name[:-11], size=convert_size(job.segments[-1][1]), status='Downloading')
+                job.progress.total = job.segments[-1][1]
+                job.progress.downloaded = sum(s[2] for s in job.segments)
+                if job.hasher:
+                    await self.loop.run_in_executor(None, job.hasher.catch_up, path, job.segments)
+                # `r` serves the first unfinished segment, the others open their own ranged requests.
+                pending = [s for s in job.segments if s[0] + s[2] < s[1]]
+                await asyncio.gather(*(self.fetch_segment(job, url, headers, s, path, r if n == 0 else None)
+                                       for n, s in enumerate(pending)))
+                if job.stopped or job.paused:
+                    return False
+                if not all(s[0] + s[2] >= s[1] for s in job.segments):
+                    # A segment failed, bypass again and fetch what is left.
+                    BREAKERS.failure(host)
+                    raise Retryable('network')
+
+        # Verifying may hash the whole file.
+        await self.loop.run_in_executor(None, finish, job, path)
+        return True
+
+    async def bypass(self, job, retry):
+        '''
+        Same as download.bypass.
+        '''
+        i = 1
+        while True:
+            if job.stopped or job.paused:
+                return None
+            if job.password == '':
+                job.progress.set(status='Waiting for password')
+                if job.control.park():
+                    return None
+                continue
+
+            if download.BYPASS_ATTEMPTS and i > download.BYPASS_ATTEMPTS:
+                job.progress.set(status='Bypass failed')
+                return None
+
+            job.progress.set(status=f'Bypassing ({i})')
+            password = job.password or ''
+            attempts = download.RACE_SIZE if not download.BYPASS_ATTEMPTS \
+                else min(download.RACE_SIZE, download.BYPASS_ATTEMPTS - i + 1)
+            async with self.bypass_slots:
+                result, tried = await self.race_bypass(job, job.link, PAYLOAD, password, attempts)
+            if result is None:
+                # Every proxy of the race failed.
+                i += tried
+                delay = retry.next(Retryable('proxy'))
+                if delay is None:
+                    return None
+                await asyncio.sleep(delay)
+                continue
+            retry.reset('proxy')
+
+            text, link = result
+            if link is not None:
+                job.progress.set(status='Bypassed')
+                return link
+            if 'Bad password' in text:
+                job.progress.set(status='Wrong password')
+                if job.control.park(password):
+                    return None
+                continue
+            raise Retryable('removed')
+
+    async def download(self, job):
+        '''
+        Same as download.download.
+        '''
+        if check_index(job):
+            return True
+        retry = Retry(job)
+        while True:
+            try:
+                with METRICS.span('bypass'):
+                    url = await self.bypass(job, retry)
+                return url is not None and await self.fetch(job, job.link, url)
+            except Retryable as error:
+                delay = retry.next(error)
+                if delay is None:
+                    return False
+                await asyncio.sleep(delay)
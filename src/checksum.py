@@ -0,0 +1,91 @@
+import hashlib
+import threading
+
+# Digest length (hex characters) to algorithm, for checksums given without one.
+ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+# Bytes read at once when the digest catches up with data already on disk.
+READ_SIZE = 4 * 1024 * 1024
+
+def parse_checksum(text):
+    '''
+    'sha256:<hex>' or a bare hex digest (algorithm guessed from its length).
+    Returns 'algorithm:hex' or None if the text is not a checksum.
+    '''
+    algorithm, _, digest = text.strip().rpartition(':')
+    digest = digest.lower()
+    algorithm = algorithm.lower() or ALGORITHMS.get(len(digest))
+    try:
+        int(digest, 16)
+        hashlib.new(algorithm)
+    except (ValueError, TypeError):
+        return None
+    return f'{algorithm}:{digest}'
+
+class Hasher:
+    '''
+    Running digest of a download, fed with the same buffers that are written to disk.
+    Only data at the current position can be hashed, downloads with a checksum are fetched
+    as one range so all of it is. Data written out of order (ranges of a download restored
+    with several) is picked up from disk by catch_up() once everything before it is written.
+    hashlib state can not be saved, a restored download starts over with catch_up().
+    '''
+    def __init__(self, checksum):
+        self.checksum = checksum
+        self.algorithm, self.expected = checksum.split(':')
+        self.hash = hashlib.new(self.algorithm)
+        self.position = 0
+        self.lock = threading.Lock()
+        # One catch_up() reads at a time, update() leaves the position to it meanwhile.
+        self.reading = threading.Lock()
+        self.catching = False
+
+    def update(self, data, offset):
+        with self.lock:
+            if offset == self.position and not self.catching:
+                self.hash.update(data)
+                self.position += len(data)
+
+    def written_end(self, segments, end):
+        # Called with the lock held.
+        if end is not None:
+            return end
+        end = self.position
+        for start, stop, done in segments or []:
+            if start <= end < stop:
+                end = max(end, start + done)
+        return end
+
+    def catch_up(self, path, segments=None, end=None):
+        '''
+        Hash what is on disk from the current position up to `end`, or to the end of
+        the written part of `segments` that follows it (which may grow while it reads).
+        The disk is read without the lock, transfers calling update() don't wait for it.
+        '''
+        with self.reading:
+            with self.lock:
+                if self.written_end(segments, end) <= self.position:
+                    return
+                self.catching = True
+            try:
+                with open(path, 'rb') as f:
+                    while True:
+                        with self.lock:
+                            position = self.position
+                            stop = self.written_end(segments, end)
+                        if stop <= position:
+                            break
+                        f.seek(position)
+                        data = f.read(min(READ_SIZE, stop - position))
+                        if not data:
+                            break
+                        # Only this thread moves the position while catching.
+                        self.hash.update(data)
+                        with self.lock:
+                            self.position += len(data)
+            finally:
+                with self.lock:
+                    self.catching = False
+
+    def verify(self, path, size):
+        self.catch_up(path, end=size)
+        return self.hash.hexdigest() == self.expected
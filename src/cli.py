@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import download
+from download import parse_lines, get_link_info, get_folder_info
+from checksum import Hasher
+from progress import BOARD, REFRESH_RATE
+from proxies import POOL, PROXY_LIST_API, CHECK_URL
+from metadata import METADATA
+import metrics
+from metrics import METRICS
+from index import INDEX
+from control import Control
+from scheduler import Scheduler, MAX_ACTIVE
+
+# Same state directory as the GUI, links resolved at once, seconds between watch directory scans.
+STATE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'app')
+RESOLVERS = 8
+WATCH_INTERVAL = 5
+
+class HeadlessWorker:
+    '''
+    Download job without a GUI, with the attributes download.download expects.
+    `password` is None for public files, `checksum` ('algorithm:hex') is verified once it completes.
+    '''
+    def __init__(self, link, dl_directory, name, size, password=None, checksum=None):
+        self.link = link
+        self.dl_directory = dl_directory
+        # Nobody can type a password here, a job with a wrong one parks and finishes.
+        self.control = Control(password)
+        self.dl_name = None
+        self.segments = None
+        self.hasher = Hasher(checksum) if checksum else None
+        self.done = False
+        self.scheduler = None
+        self.rate_limit = None
+        self.progress = BOARD.open(self)
+        self.progress.set(name=name, size=size, status='Queued')
+
+    @property
+    def paused(self):
+        return self.control.paused
+
+    @property
+    def stopped(self):
+        return self.control.stopped
+
+    @property
+    def password(self):
+        return self.control.password
+
+    def run(self):
+        try:
+            download.download(self)
+        except Exception as e:
+            self.progress.set(status=f'Failed ({e})')
+        self.finish()
+
+    def finish(self):
+        if self.paused:
+            self.progress.set(status='Paused')
+        self.done = True
+        self.progress.close()
+        if self.scheduler:
+            self.scheduler.finished(self)
+
+    def complete(self):
+        return self.progress.status.startswith('Complete')
+
+class Headless:
+    def __init__(self, args):
+        self.args = args
+        self.scheduler = Scheduler(self.start, max_active=args.jobs, rate=args.rate * 1024)
+        self.engine = None
+        if args.engine == 'asyncio':
+            # Imported here so the default engine does not need aiohttp.
+            from aio import AsyncEngine
+            self.engine = AsyncEngine(self.scheduler)
+        self.jobs = []
+        self.queued = set()
+        self.lock = threading.Lock()
+
+    def start(self, job):
+        if self.engine:
+            self.engine.start(job)
+        else:
+            threading.Thread(target=job.run, daemon=True).start()
+
+    def output(self, record):
+        if self.args.json:
+            print(json.dumps(record), flush=True)
+        else:
+            percent = f'{record["percent"]:5.1f}%' if record.get('percent') is not None else '     -'
+            speed = f' {record["speed"]}' if record.get('speed') else ''
+            eta = f' ETA {record["eta"]}' if record.get('eta') else ''
+            print(f'[{percent}] {record["name"]}: {record["status"]}{speed}{eta}', flush=True)
+
+    def resolve(self, link):
+        '''
+        Returns [(link, name, size, password), ...] or None if the link could not be resolved.
+        '''
+        if '/dir/' in link:
+            folder = get_folder_info(link)
+            if folder is None:
+                return None
+            return [(f['link'], f['filename'], download.convert_size(int(f['size'])),
+                     self.args.password if f['password'] == 1 else None) for f in folder]
+        info = get_link_info(link)
+        if info is None:
+            return None
+        if info[0] == 'Private File':
+            return [(link, link, info[1], self.args.password)]
+        return [(link, info[0], info[1], None)]
+
+    def add(self, text):
+        with self.lock:
+            checksums = dict(parse_lines(text))
+            links = [l for l in checksums if l not in self.queued]
+            self.queued.update(links)
+
+        with ThreadPoolExecutor(RESOLVERS) as executor:
+            for link, files in zip(links, executor.map(self.resolve, links)):
+                if files is None:
+                    self.output({'link': link, 'name': link, 'status': 'Invalid link'})
+                    continue
+                for file_link, name, size, password in files:
+                    if password == '':
+                        self.output({'link': file_link, 'name': name, 'status': 'Password required'})
+                        continue
+                    job = HeadlessWorker(file_link, self.args.output, name, size, password, checksums.get(file_link))
+                    job.scheduler = self.scheduler
+                    job.rate_limit = self.args.job_rate * 1024 or None
+                    self.jobs.append(job)
+                    self.scheduler.submit(job)
+
+    def watch(self, directory):
+        '''
+        Queue the links of every new .txt file in `directory`, the file is renamed to .queued.
+        '''
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith('.txt'):
+                with open(entry.path) as f:
+                    text = f.read()
+                os.replace(entry.path, entry.path[:-4] + '.queued')
+                self.add(text)
+
+    def report(self):
+        for job, (name, size, status, speed, percent, eta) in BOARD.snapshot():
+            self.output({'link': job.link, 'name': name, 'size': size, 'status': status,
+                         'speed': speed if status == 'Downloading' else None,
+                         'percent': percent, 'eta': eta})
+
+    def run(self):
+        last_scan = 0
+        while True:
+            if self.args.watch and time.monotonic() - last_scan > WATCH_INTERVAL:
+                self.watch(self.args.watch)
+                last_scan = time.monotonic()
+            self.report()
+            if not self.args.watch and all(job.done for job in self.jobs):
+                self.report()
+                return
+            time.sleep(1 / REFRESH_RATE)
+
+    def pause(self):
+        for job in self.jobs:
+            job.control.pause()
+            self.scheduler.remove(job)
+        # Running jobs stop right away, give them a moment to keep their partial files.
+        deadline = time.monotonic() + 5
+        while self.scheduler.active and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='1fichier-dl', description='1Fichier Download Manager, headless mode.')
+    parser.add_argument('links', nargs='*', help='1fichier file or /dir/ links')
+    parser.add_argument('-i', '--input', action='append', default=[], metavar='FILE',
+                        help="read links from FILE, '-' for stdin (repeatable)")
+    parser.add_argument('-w', '--watch', metavar='DIR',
+                        help='daemon mode: keep running and queue links from new .txt files in DIR')
+    parser.add_argument('-o', '--output', default=os.getcwd(), metavar='DIR', help='download directory')
+    parser.add_argument('-p', '--password', default='', help='password for private files')
+    parser.add_argument('-j', '--jobs', type=int, default=MAX_ACTIVE, help='simultaneous downloads')
+    parser.add_argument('--rate', type=int, default=0, metavar='KB/s', help='global bandwidth limit')
+    parser.add_argument('--job-rate', type=int, default=0, metavar='KB/s', help='bandwidth limit per download')
+    parser.add_argument('--segments', type=int, default=download.SEGMENTS, help='connections per download')
+    parser.add_argument('--race', type=int, default=download.RACE_SIZE, help='proxies tried at once per bypass')
+    parser.add_argument('--proxy-list', default=PROXY_LIST_API, metavar='URL',
+                        help='proxy list API returning one host:port per line')
+    parser.add_argument('--proxy-check', default=CHECK_URL, metavar='URL', help='URL proxies are validated against')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads',
+                        help='one thread per download, or every download on one asyncio event loop')
+    parser.add_argument('--json', action='store_true', help='print progress as JSON lines')
+    parser.add_argument('--state', default=STATE_DIR, metavar='DIR', help='where proxies and link metadata are kept')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='serve /metrics (Prometheus) and /metrics.json on localhost:PORT')
+    parser.add_argument('--metrics-json', metavar='FILE', help='write counters and timings to FILE on exit')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='write a cProfile dump of every download to DIR (threads engine)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    download.SEGMENTS = args.segments
+    download.RACE_SIZE = args.race
+    os.makedirs(args.output, exist_ok=True)
+    if args.profile:
+        metrics.PROFILE_DIR = args.profile
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+
+    METADATA.load(os.path.join(args.state, 'metadata'))
+    INDEX.load(os.path.join(args.state, 'index'))
+    POOL.api = args.proxy_list
+    POOL.check_url = args.proxy_check
+    POOL.load(os.path.join(args.state, 'proxies'))
+    POOL.prefetch()
+
+    headless = Headless(args)
+    try:
+        headless.add('\n'.join(args.links))
+        for name in args.input:
+            if name == '-':
+                headless.add(sys.stdin.read())
+            else:
+                with open(name) as f:
+                    headless.add(f.read())
+        headless.run()
+    except KeyboardInterrupt:
+        headless.pause()
+        headless.report()
+    finally:
+        POOL.save()
+        METADATA.save()
+        INDEX.save()
+        if args.metrics_json:
+            METRICS.dump(args.metrics_json)
+
+    return 0 if headless.jobs and all(job.complete() for job in headless.jobs) else 1
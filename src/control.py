@@ -0,0 +1,91 @@
+import threading
+from contextlib import contextmanager
+
+class Control:
+    '''
+    Control channel of one download: pause, stop and the password.
+    Waits end as soon as the download is paused or stopped, and callbacks
+    registered with on_halt() (closing a response, cancelling a task) run right away.
+    A download that needs a password parks instead of waiting: it returns, and
+    `on_wake` is called once a usable password is set.
+    `password` is None when the file needs none, '' until one is given.
+    '''
+    def __init__(self, password=None, on_wake=None):
+        self.password = password
+        self.on_wake = on_wake
+        self.paused = self.stopped = self.parked = False
+        self.callbacks = set()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    @property
+    def halted(self):
+        return self.paused or self.stopped
+
+    def halt(self, stop=False):
+        with self.lock:
+            if stop:
+                self.stopped = True
+            else:
+                self.paused = True
+            callbacks = list(self.callbacks)
+            self.changed.notify_all()
+        for callback in callbacks:
+            callback()
+
+    def pause(self):
+        self.halt()
+
+    def stop(self):
+        self.halt(stop=True)
+
+    def resume(self):
+        with self.lock:
+            self.paused = self.parked = False
+
+    def set_password(self, password):
+        with self.lock:
+            self.password = password
+            wake = self.parked and password != ''
+            if wake:
+                self.parked = False
+            self.changed.notify_all()
+        if wake and self.on_wake:
+            self.on_wake()
+
+    def park(self, password=''):
+        '''
+        Called by the download when it can not go on with `password`.
+        Returns False if another password was set meanwhile, else the download should return.
+        '''
+        with self.lock:
+            if (self.password or '') not in (password, ''):
+                return False
+            self.parked = True
+            return True
+
+    def wait(self, timeout):
+        '''
+        Sleep up to `timeout` seconds. Returns True if the download was paused or stopped.
+        '''
+        with self.lock:
+            if not self.halted:
+                self.changed.wait(timeout)
+            return self.halted
+
+    @contextmanager
+    def on_halt(self, callback):
+        '''
+        Run `callback` if the download is paused or stopped while the block runs
+        (right away if it already is).
+        '''
+        with self.lock:
+            self.callbacks.add(callback)
+            halted = self.halted
+        if halted:
+            callback()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.callbacks.discard(callback)
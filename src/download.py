@@ -1,19 +1,51 @@
-import requests
+import sessions
+import pages
 import math
 import os
+import re
 import time
-import lxml.html
-import PyQt5.sip
-from random import choice
-from PyQt5.QtGui import QStandardItem
-from PyQt5.QtWidgets import QProgressBar
+import queue
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, unquote
+from proxies import POOL
+from metadata import METADATA
+from checksum import parse_checksum
+from index import INDEX
+from metrics import METRICS, profile
+from retry import BREAKERS, BREAKER_COOLDOWN, Retry, Retryable
 
-PROXY_TXT_API = 'https://www.proxyscan.io/api/proxy?type=https&format=txt'
-PLATFORM = os.name
-
-def get_proxy():
-    proxy = requests.get(PROXY_TXT_API).text
-    return proxy.rstrip()
+# Segmented downloads: number of parallel ranges and the smallest range worth its own connection.
+SEGMENTS = 4
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+# Transfer: reads grow from MIN_CHUNK to MAX_CHUNK while the link keeps up
+# and data is written to disk once per BUFFER_SIZE.
+# Segmented downloads add up their ranges into worker.progress every PROGRESS_INTERVAL seconds.
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 1024 * 1024
+BUFFER_SIZE = 4 * 1024 * 1024
+PROGRESS_INTERVAL = 0.5
+# Bypass: POST through RACE_SIZE proxies at once and keep the first direct link.
+# BYPASS_TIMEOUT is the (connect, read) timeout of one attempt,
+# BYPASS_ATTEMPTS caps the proxies tried per download (None = no limit).
+RACE_SIZE = 4
+BYPASS_TIMEOUT = (5, 15)
+BYPASS_ATTEMPTS = None
+# File pages are parsed as they arrive, PAGE_CHUNK bytes at a time.
+PAGE_CHUNK = 8 * 1024
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.131 Safari/537.36'
+PAYLOAD = {'dl_no_ssl': 'on', 'dlinline': 'on'}
+ALREADY_DOWNLOADED = 'Complete (already downloaded)'
+# 1fichier pages without a direct link: the file is gone, or the proxy has to wait (minutes) between downloads,
+# WAIT_TIMER_DEFAULT seconds when the page gives no time.
+REMOVED = re.compile(r'file (?:has been deleted|could not be found|does not exist)|file not found', re.I)
+WAIT_TIMER = re.compile(r'must wait(?:\D{0,20}?(\d+) minutes?)?', re.I)
+WAIT_TIMER_DEFAULT = 5 * 60
+# File name of a Content-Disposition header: filename*=UTF-8''percent%20encoded (RFC 6266),
+# else filename="quoted" or filename=bare.
+FILENAME_EXT = re.compile(r'''filename\*\s*=\s*[\w-]*'[^']*'([^;\s]+)''', re.I)
+FILENAME = re.compile(r'''filename\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^;\s]+))''', re.I)
 
 def convert_size(size_bytes):
     # https://stackoverflow.com/a/14822210
@@ -25,134 +57,623 @@ def convert_size(size_bytes):
     s = round(size_bytes / p, 2)
     return '%s %s' % (s, size_name[i])
 
-def download_speed(bytes_read, start_time):
-    if bytes_read == 0:
-        return '0 B/s'
-    elif time.time()-start_time == 0:
-        return '- B/s'
-    size_name = ('B/s', 'KB/s', 'MB/s', 'GB/s', 'TB/s')
-    bps = bytes_read/(time.time()-start_time)
-    i = int(math.floor(math.log(bps, 1024)))
-    p = math.pow(1024, i)
-    s = round(bps / p, 2)
-    return '%s %s' % (s, size_name[i])
+def parse_lines(text):
+    '''
+    (link, checksum or None) for every valid 1fichier link of a text, one per line,
+    with the scheme added and the affiliate part removed.
+    A checksum may follow the link on its line, see checksum.parse_checksum.
+    '''
+    lines = []
+    for line in text.splitlines():
+        words = line.split()
+        if words and '1fichier.com/' in words[0]:
+            link = words[0]
+            if not 'https://' in link[0:8] and not 'http://' in link[0:7]:
+                link = f'https://{link}'
+            if '&af=' in link:
+                link = link.split('&af=')[0]
+            lines.append((link, parse_checksum(words[1]) if len(words) > 1 else None))
+    return lines
+
+def parse_links(text):
+    return [link for link, _ in parse_lines(text)]
 
 def get_link_info(url):
+    info = METADATA.get(url)
+    if info is not None:
+        return list(info)
     try:
-        r = requests.get(url)
-        html = lxml.html.fromstring(r.content)
-        if html.xpath('//*[@id="pass"]'):
-            return ['Private File', '- MB']
-        name = html.xpath('//td[@class=\'normal\']')[0].text
-        size = html.xpath('//td[@class=\'normal\']')[2].text
-        return [name, size]
+        with METRICS.span('link_info'), sessions.get(url, stream=True) as r:
+            chunks = r.iter_content(PAGE_CHUNK)
+            info = pages.link_info(chunks)
+            # The rest of the page is read unparsed, so the connection stays open for the next link.
+            for _ in chunks:
+                pass
     except:
         return None
+    if info is None:
+        return None
+    METADATA.put(url, info)
+    return list(info)
 
-def download(worker, payload={'dl_no_ssl': 'on', 'dlinline': 'on'}, downloaded_size = 0):
+def get_folder_info(url):
+    '''
+    Files of a /dir/ folder as listed by ?json=1 (link, filename, size, password).
+    '''
+    folder = METADATA.get(url)
+    if folder is None:
+        try:
+            folder = sessions.get(f'{url}?json=1').json()
+        except:
+            return None
+        METADATA.put(url, folder)
+        for f in folder:
+            if f['password'] != 1:
+                METADATA.put(f['link'], [f['filename'], convert_size(int(f['size']))])
+    return folder
+
+def check_index(worker):
+    '''
+    Look the worker's link up in the download index before anything is requested.
+    Returns True when its file is already complete in the download directory,
+    an unfinished one is resumed through worker.dl_name and worker.segments.
+    '''
     if worker.dl_name:
+        return False
+    known = INDEX.find(worker.link, worker.dl_directory)
+    if known is None:
+        return False
+    if known[2]:
+        worker.progress.set(status=ALREADY_DOWNLOADED)
+        return True
+    worker.dl_name, worker.segments = known[0], known[1]
+    return False
+
+def get_total_size(status, headers):
+    '''
+    Total file size from a ranged response (Content-Range: bytes a-b/total).
+    Returns None when the server ignored the Range header.
+    '''
+    if status == 206 and '/' in headers.get('Content-Range', ''):
+        total = headers['Content-Range'].split('/')[1]
+        return int(total) if total.isdigit() else None
+
+def content_length(headers):
+    '''
+    Length of the body, None when the response doesn't say (chunked).
+    '''
+    try:
+        return int(headers['Content-Length'])
+    except (KeyError, ValueError):
+        return None
+
+def served_from(status, headers, start):
+    '''
+    True if a response to Range: bytes=`start`- begins at `start`.
+    A server that ignored the Range header sends the file from byte 0, written at `start` it would corrupt it.
+    '''
+    if not start:
+        return True
+    if status != 206:
+        return False
+    first = headers.get('Content-Range', '').removeprefix('bytes ').split('-')[0]
+    return first.isdigit() and int(first) == start
+
+def preallocate(path, size):
+    '''
+    Reserve the final size of a download up front so the file is laid out in one piece
+    instead of growing write by write. Falls back to a sparse file where fallocate is missing.
+    '''
+    with open(path, 'ab') as f:
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f.truncate(size)
+
+def write_at(f, data, offset):
+    '''
+    Positioned write (pwrite): no seek, the file position is left alone.
+    '''
+    if not hasattr(os, 'pwrite'):
+        f.seek(offset)
+        f.write(data)
+        return
+    data = memoryview(data)
+    while data:
+        n = os.pwrite(f.fileno(), data, offset)
+        data = data[n:]
+        offset += n
+
+def split_segments(size, parts):
+    # [start, end, done] per range, end exclusive, done = bytes already written.
+    step = max(MIN_SEGMENT_SIZE, -(-size // parts))
+    return [[start, min(start + step, size), 0] for start in range(0, size, step)]
+
+def transfer(worker, r, f, length=None, on_write=None, offset=None):
+    '''
+    Copy the body of `r` into `f` through one reusable buffer.
+    Reads land directly in the buffer (readinto) and are flushed with a single
+    write per BUFFER_SIZE, or earlier once PROGRESS_INTERVAL has passed since the last
+    flush so progress keeps moving on slow links. The read size adapts: it doubles while reads return
+    quickly and halves on slow links so pause/stop stays responsive.
+    Stops after `length` bytes, at the end of the body or when the worker is stopped/paused.
+    With an `offset` data is written in place from there (write_at), else appended to `f`.
+    `on_write(n)` is called after every disk write. Returns the number of bytes written.
+    '''
+    start = time.perf_counter()
+    r.raw.decode_content = True
+    buf = bytearray(BUFFER_SIZE)
+    view = memoryview(buf)
+    chunk_size = MIN_CHUNK
+    written = 0
+    eof = False
+
+    while not eof and not (worker.stopped or worker.paused):
+        filled = 0
+        flushed = time.monotonic()
+        while filled < BUFFER_SIZE:
+            want = min(chunk_size, BUFFER_SIZE - filled)
+            if length is not None:
+                want = min(want, length - written - filled)
+            if want <= 0:
+                eof = True
+                break
+            t = time.monotonic()
+            try:
+                n = r.raw.readinto(view[filled:filled + want])
+            except Exception:
+                if not (worker.stopped or worker.paused):
+                    raise
+                # Read cut short by pause/stop (see interrupt), keep what was read.
+                n = 0
+            if not n:
+                eof = True
+                break
+            filled += n
+            t = time.monotonic() - t
+            if worker.scheduler:
+                worker.scheduler.throttle(worker, n)
+            if n == want and t < 0.1:
+                chunk_size = min(chunk_size * 2, MAX_CHUNK)
+            elif t > 0.5:
+                chunk_size = max(chunk_size // 2, MIN_CHUNK)
+            if worker.stopped or worker.paused or time.monotonic() - flushed > PROGRESS_INTERVAL:
+                break
+        if filled:
+            position = f.tell() if offset is None else offset + written
+            t = time.perf_counter()
+            if offset is None:
+                f.write(view[:filled])
+            else:
+                write_at(f, view[:filled], position)
+            METRICS.observe('disk_write', time.perf_counter() - t)
+            METRICS.inc('bytes', filled)
+            written += filled
+            if on_write:
+                on_write(filled)
+            if worker.hasher:
+                worker.hasher.update(view[:filled], position)
+
+    METRICS.observe('transfer', time.perf_counter() - start)
+    return written
+
+def verify_status(hasher, path, size):
+    '''
+    Status column text once the digest of a finished download is compared.
+    '''
+    if hasher.verify(path, size):
+        return f'Complete, {hasher.algorithm} OK'
+    return f'Checksum mismatch ({hasher.algorithm})'
+
+def interrupt(r):
+    '''
+    Callback ending a read of `r` that is blocked in another thread.
+    '''
+    def shutdown():
         try:
-            downloaded_size = os.path.getsize(worker.dl_directory + '/' + worker.dl_name)
-        except FileNotFoundError:
-            downloaded_size = 0
-    url = worker.link
-    i = 1
+            getattr(r.raw, 'shutdown', r.close)()
+        except Exception:
+            # Connection already closed or released.
+            pass
+    return shutdown
+
+def fetch_segment(worker, url, headers, segment, path, r=None):
+    '''
+    Download one byte range into its offset of the .unfinished file.
+    `r` may be an already opened response starting at the segment's resume position.
+    '''
+    try:
+        if r is None:
+            headers = dict(headers, Range=f'bytes={segment[0] + segment[2]}-{segment[1] - 1}')
+            with METRICS.span('ttfb'):
+                r = sessions.get(url, stream=True, headers=headers)
+        r.raise_for_status()
+        if not served_from(r.status_code, r.headers, segment[0] + segment[2]):
+            raise Retryable('network')
+        with open(path, 'r+b') as f, worker.control.on_halt(interrupt(r)):
+            def on_write(n):
+                segment[2] += n
+
+            transfer(worker, r, f, segment[1] - segment[0] - segment[2], on_write, segment[0] + segment[2])
+        if worker.hasher:
+            # Hash the ranges after this one as far as they are written, the digest continues inline from there.
+            worker.hasher.catch_up(path, worker.segments)
+    except:
+        # Segment failed, it stays unfinished in the progress map.
+        pass
+    finally:
+        if r is not None:
+            r.close()
+
+def profiled_segment(worker, url, headers, segment, path, r):
+    with profile(worker, f'segment-{segment[0]}'):
+        fetch_segment(worker, url, headers, segment, path, r)
+
+def download_segments(worker, url, headers, path, r):
+    '''
+    Fetch all unfinished segments of worker.segments in parallel.
+    `r` is the response for the first unfinished segment.
+    Returns True once every segment is complete.
+    '''
+    pending = [s for s in worker.segments if s[0] + s[2] < s[1]]
+    threads = []
+    for n, segment in enumerate(pending):
+        t = threading.Thread(target=profiled_segment,
+                             args=(worker, url, headers, segment, path, r if n == 0 else None),
+                             daemon=True)
+        t.start()
+        threads.append(t)
+
+    worker.progress.total = worker.segments[-1][1]
+    worker.progress.downloaded = sum(s[2] for s in worker.segments)
     while True:
-        if worker.stopped or worker.paused:
-            return None if not worker.dl_name else worker.dl_name
-    
-        while True:
-            if not PyQt5.sip.isdeleted(worker.data[5]):
-                if worker.data[5].text() == '':
-                    worker.signals.update_signal.emit(worker.data, [None, None, 'Waiting for password'])
-                    time.sleep(2)
-                else:
-                    break
-                if worker.stopped or worker.paused:
-                    return None if not worker.dl_name else worker.dl_name
+        alive = [t for t in threads if t.is_alive()]
+        if not alive:
+            break
+        # Join a running segment, a finished one would return at once.
+        alive[0].join(PROGRESS_INTERVAL)
+        worker.progress.downloaded = sum(s[2] for s in worker.segments)
+
+    return all(s[0] + s[2] >= s[1] for s in worker.segments)
+
+def proxy_limit(status, text):
+    '''
+    Seconds a proxy has to wait when 1fichier answered it with a wait timer or 429/503, else None.
+    '''
+    m = WAIT_TIMER.search(text)
+    if m:
+        return int(m.group(1)) * 60 if m.group(1) else WAIT_TIMER_DEFAULT
+    if status in (429, 503):
+        return BREAKER_COOLDOWN
+
+def relayed(text, link, asked, cooldown):
+    '''
+    True if a bypass answer comes from 1fichier: a password form, a wait timer or a settled answer.
+    Anything else is the proxy answering itself (403, 502, ...) and counts as a failed proxy.
+    '''
+    return asked or cooldown is not None or settled(text, link)
 
-        worker.signals.update_signal.emit(worker.data, [None, None, f'Bypassing ({i})'])
+def bypass_attempt(url, payload, proxy, password, race):
+    '''
+    POST the download form through one proxy, answering the password form if asked.
+    Returns (response, direct link or None) or None once another attempt of the race already won.
+    A proxy 1fichier makes wait is benched by the circuit breaker for that long.
+    '''
+    try:
+        t = time.monotonic()
+        with METRICS.span('bypass_post'):
+            r = sessions.post(url, payload, proxy, timeout=BYPASS_TIMEOUT)
+        latency = time.monotonic() - t
+        asked = pages.password_form(r.content)
+        if asked and not race.is_set():
+            with METRICS.span('bypass_post'):
+                r = sessions.post(url, dict(payload, **{'pass': password}), proxy, timeout=BYPASS_TIMEOUT)
+        with METRICS.span('parse'):
+            link = pages.direct_link(r.content)
+    except:
+        # Proxy failed.
+        POOL.report(proxy, False)
+        return None
+    cooldown = proxy_limit(r.status_code, r.text) if link is None else None
+    if not relayed(r.text, link, asked, cooldown):
+        POOL.report(proxy, False)
+        return None
+    POOL.report(proxy, True, latency)
+    if cooldown is not None:
+        BREAKERS.failure(proxy, cooldown)
+        METRICS.inc('proxy_limited')
+        return None
+    return r, link
 
-        proxy = get_proxy()
-        proxies = {'https': proxy} if PLATFORM == 'nt' else {'https': f'https://{proxy}'}
+def settled(text, link):
+    '''
+    True for a bypass answer no other proxy would change: the direct link, a bad password or a removed file.
+    '''
+    return link is not None or 'Bad password' in text or bool(REMOVED.search(text))
 
+def race_bypass(worker, url, payload, password, attempts):
+    '''
+    Run up to `attempts` bypass attempts through distinct proxies concurrently.
+    The first settled response wins, pending attempts are cancelled and running ones
+    are left to time out in the background, as are all of them when the download is paused or stopped.
+    Returns ((response, direct link) or None, number of proxies tried).
+    '''
+    addresses = []
+    for _ in range(attempts):
         try:
-            r = requests.post(url, payload, proxies=proxies)
-            html = lxml.html.fromstring(r.content)
-            if html.xpath('//*[@id="pass"]'):
-                payload['pass'] = worker.data[5].text()
-                r = requests.post(url, payload, proxies=proxies)
-        except:
-            # Proxy failed.
-            i += 1
-        else:
-            if worker.stopped or worker.paused:
-                return None if not worker.dl_name else worker.dl_name
-
-            worker.signals.update_signal.emit(worker.data, [None, None, 'Bypassed'])
-            # Proxy worked.
+            addresses.append(POOL.get(exclude=addresses))
+        except LookupError:
             break
+    if not addresses:
+        return None, 1
+
+    race = threading.Event()
+    executor = ThreadPoolExecutor(len(addresses))
+    futures = [executor.submit(bypass_attempt, url, payload, a, password, race) for a in addresses]
+    # Finished attempts, or None once the download is paused or stopped.
+    done = queue.SimpleQueue()
+    for future in futures:
+        future.add_done_callback(done.put)
+    winner = None
+    try:
+        with worker.control.on_halt(lambda: done.put(None)):
+            for _ in futures:
+                future = done.get()
+                if future is None:
+                    break
+                result = future.result()
+                if result and settled(result[0].text, result[1]):
+                    winner = result
+                    break
+    finally:
+        race.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    return winner, len(addresses)
+
+def bypass(worker, payload, retry):
+    '''
+    Race proxies until one gets the direct link, waiting for a password first if the file needs one.
+    Returns the direct link, or None once the download is paused, stopped, parked or gives up.
+    Raises Retryable('removed') when the file is gone.
+    '''
+    i = 1
+    while True:
+        if worker.stopped or worker.paused:
+            return None
+
+        if worker.password == '':
+            worker.progress.set(status='Waiting for password')
+            if worker.control.park():
+                # The worker is woken up once a password is set.
+                return None
+            continue
+
+        if BYPASS_ATTEMPTS and i > BYPASS_ATTEMPTS:
+            worker.progress.set(status='Bypass failed')
+            return None
 
-    if not html.xpath('/html/body/div[4]/div[2]/a'):
+        worker.progress.set(status=f'Bypassing ({i})')
+        password = worker.password or ''
+        attempts = RACE_SIZE if not BYPASS_ATTEMPTS else min(RACE_SIZE, BYPASS_ATTEMPTS - i + 1)
+        with worker.scheduler.bypassing(worker) if worker.scheduler else nullcontext():
+            result, tried = race_bypass(worker, worker.link, payload, password, attempts)
+        if worker.stopped or worker.paused:
+            return None
+
+        if result is None:
+            # Every proxy of the race failed.
+            i += tried
+            if not retry.wait(Retryable('proxy')):
+                return None
+            continue
+        retry.reset('proxy')
+
+        r, link = result
+        if link is not None:
+            worker.progress.set(status='Bypassed')
+            return link
         if 'Bad password' in r.text:
-            worker.signals.update_signal.emit(worker.data, [None, None, 'Wrong password'])
-            while True:
-                if not PyQt5.sip.isdeleted(worker.data[5]):
-                    if worker.data[5].text() == payload['pass']:
-                        time.sleep(2)
-                    else:
-                        break
-                else:
-                    worker.stopped = True
-                    return None if not worker.dl_name else worker.dl_name
-        download(worker)
+            worker.progress.set(status='Wrong password')
+            if worker.control.park(password):
+                return None
+            continue
+        raise Retryable('removed')
+
+def resume_position(worker):
+    '''
+    Byte the next request for `worker` starts from.
+    '''
+    if worker.segments:
+        # Resume from the first unfinished segment, the others are fetched alongside it.
+        return next((s[0] + s[2] for s in worker.segments if s[0] + s[2] < s[1]), 0)
+    # Only files of unknown size, and downloads saved by older versions, have no range map.
+    try:
+        return os.path.getsize(worker.dl_directory + '/' + worker.dl_name) if worker.dl_name else 0
+    except FileNotFoundError:
+        return 0
+
+def file_name(disposition):
+    '''
+    File name given by a Content-Disposition header, without any directory part, or None.
+    '''
+    m = FILENAME_EXT.search(disposition)
+    if m:
+        name = unquote(m.group(1), errors='replace')
     else:
-        old_url = url
-        url = html.xpath('/html/body/div[4]/div[2]/a')[0].get('href')
-    
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.131 Safari/537.36',
-            'Referer': old_url,
-            'Range': f'bytes={downloaded_size}-' 
-        }
-
-        r = requests.get(url, stream=True, headers=headers)
-
-        if 'Content-Disposition' in r.headers:
-            name = r.headers['Content-Disposition'].split('"')[1]
-
-            if worker.dl_name:
-                name = worker.dl_name
-            elif os.path.exists(f'{worker.dl_directory}/{name}'):
-                i = 1
-                while os.path.exists(f'{worker.dl_directory}/({i}) {name}'):
-                    i += 1
-                name = f'({i}) {name}'
-
-            name = f'{name}.unfinished' if name[-11:] != '.unfinished' else name
-            worker.dl_name = name
-
-            if worker.stopped or worker.paused: return name
-
-            worker.signals.update_signal.emit(worker.data, [name[:-11], convert_size(float(r.headers['Content-Length'])+downloaded_size)])
-
-            with open(worker.dl_directory + '/' + name, 'ab') as f:
-                worker.signals.update_signal.emit(worker.data, [None, None, 'Downloading'])
-                itrcount=1
-                chunk_size = 1024
-                bytes_read = 0
-                start = time.time()
-                for chunk in r.iter_content(chunk_size):
-                    itrcount=itrcount+1
-                    f.write(chunk)
-                    bytes_read += len(chunk)
-                    total_per = 100 * (float(bytes_read) + downloaded_size)
-                    total_per /= float(r.headers['Content-Length']) + downloaded_size
-                    dl_speed = download_speed(bytes_read, start)
-                    if worker.stopped or worker.paused: return name
-                    worker.signals.update_signal.emit(worker.data, [None, None, 'Downloading', dl_speed, round(total_per, 1)])
-            os.rename(worker.dl_directory + '/' + name, worker.dl_directory + '/' + name[:-11])
-            worker.signals.update_signal.emit(worker.data, [None, None, 'Complete'])
-        else:
-            download(worker)
-    return
\ No newline at end of file
+        m = FILENAME.search(disposition)
+        if not m:
+            return None
+        name = re.sub(r'\\(.)', r'\1', m.group(1)) if m.group(1) is not None else m.group(2)
+    name = os.path.basename(name.replace('\\', '/')).strip()
+    return name if name not in ('', '.', '..') else None
+
+def check_response(host, status, headers, downloaded_size):
+    '''
+    Raises Retryable unless the download server `host` answered with the file from `downloaded_size` on.
+    '''
+    if status in (429, 503):
+        BREAKERS.failure(host)
+        raise Retryable('rate_limited')
+    if 'Content-Disposition' not in headers:
+        raise Retryable('no_file')
+    BREAKERS.success(host)
+    if not served_from(status, headers, downloaded_size):
+        raise Retryable('network')
+
+def prepare_file(worker, status, headers, downloaded_size):
+    '''
+    Reserve the file's name and give a new download of known size its range map.
+    Returns the path of the .unfinished file, or None when the file is already in the directory.
+    Blocking, the file is created and preallocated.
+    '''
+    name = file_name(headers['Content-Disposition'])
+    if name is None:
+        raise Retryable('no_file')
+    total = get_total_size(status, headers)
+    if total is None and not downloaded_size and status == 200:
+        total = content_length(headers) or None
+
+    if worker.dl_name:
+        name = worker.dl_name
+    else:
+        name = INDEX.reserve(worker.link, worker.dl_directory, name, total)
+        if name is None:
+            # Same name and size already in the directory.
+            worker.progress.set(status=ALREADY_DOWNLOADED)
+            return None
+
+    name = f'{name}.unfinished' if name[-11:] != '.unfinished' else name
+    worker.dl_name = name
+    path = worker.dl_directory + '/' + name
+
+    if not worker.segments and total and not downloaded_size:
+        # Files under 2 * MIN_SEGMENT_SIZE get a single range, written the same way,
+        # as do files with a checksum so the digest is computed inline (see checksum.Hasher).
+        worker.segments = split_segments(total, 1 if worker.hasher else max(SEGMENTS, 1))
+        preallocate(path, total)
+        INDEX.track(worker.link, worker.segments)
+    return path
+
+def finish(worker, path):
+    '''
+    Check the digest if a checksum was given, then rename the .unfinished file and mark the link complete.
+    Blocking, the digest may have to be computed from the file.
+    '''
+    status = 'Complete'
+    if worker.hasher:
+        worker.progress.set(status='Verifying')
+        with METRICS.span('verify'):
+            status = verify_status(worker.hasher, path, worker.progress.total)
+    with METRICS.span('rename'):
+        os.rename(path, path[:-11])
+    INDEX.complete(worker.link)
+    METRICS.inc('downloads', status=status.split(',')[0])
+    worker.progress.downloaded = worker.progress.total
+    worker.progress.set(status=status)
+
+def fetch(worker, referer, url):
+    '''
+    Download the file behind a direct link, resuming what is already on disk.
+    Returns True once it is complete (or already was), False when paused or stopped.
+    Raises Retryable when the link has to be bypassed again.
+    '''
+    downloaded_size = resume_position(worker)
+    headers = {
+        'User-Agent': USER_AGENT,
+        'Referer': referer,
+        'Range': f'bytes={downloaded_size}-'
+    }
+
+    host = urlsplit(url).hostname
+    if not BREAKERS.allow(host):
+        raise Retryable('network', BREAKERS.remaining(host))
+    try:
+        with METRICS.span('ttfb'):
+            r = sessions.get(url, stream=True, headers=headers)
+    except:
+        BREAKERS.failure(host)
+        raise Retryable('network')
+    try:
+        check_response(host, r.status_code, r.headers, downloaded_size)
+        path = prepare_file(worker, r.status_code, r.headers, downloaded_size)
+    except:
+        r.close()
+        raise
+    if path is None:
+        r.close()
+        return True
+    if worker.stopped or worker.paused:
+        r.close()
+        return False
+    name = worker.dl_name
+
+    if worker.segments:
+        worker.progress.set(name=name[:-11], size=convert_size(worker.segments[-1][1]))
+        worker.progress.set(status='Downloading')
+        if worker.hasher:
+            # No-op unless the digest was lost with a restart, then the written part is hashed again.
+            worker.hasher.catch_up(path, worker.segments)
+        if not download_segments(worker, url, headers, path, r):
+            if worker.stopped or worker.paused: return False
+            # A segment failed, bypass again and fetch what is left.
+            BREAKERS.failure(host)
+            raise Retryable('network')
+    else:
+        # None for a chunked response, the body is then read to its end.
+        length = content_length(r.headers)
+        worker.progress.set(name=name[:-11])
+        if length is not None:
+            worker.progress.set(size=convert_size(float(length) + downloaded_size))
+
+        with open(path, 'ab') as f:
+            worker.progress.set(status='Downloading')
+            worker.progress.total = length + downloaded_size if length is not None else 0
+            worker.progress.downloaded = downloaded_size
+
+            def on_write(n):
+                worker.progress.downloaded += n
+
+            if worker.hasher:
+                worker.hasher.catch_up(path, end=downloaded_size)
+            with worker.control.on_halt(interrupt(r)):
+                try:
+                    written = transfer(worker, r, f, on_write=on_write)
+                except:
+                    written = None
+            r.close()
+            if worker.stopped or worker.paused: return False
+            if written is None or length is not None and written != length:
+                # Cut off, the next try appends the rest.
+                BREAKERS.failure(host)
+                raise Retryable('network')
+            worker.progress.total = worker.progress.downloaded
+
+    finish(worker, path)
+    return True
+
+def download(worker, payload=PAYLOAD):
+    '''
+    Bypass and fetch until the file is complete, failures are retried as set in retry.POLICIES.
+    Returns True once the file is complete (or already was), False when paused, stopped, parked
+    or given up, worker.dl_name then names the .unfinished file if there is one.
+    '''
+    if check_index(worker):
+        return True
+    retry = Retry(worker)
+    with profile(worker):
+        while True:
+            try:
+                with METRICS.span('bypass'):
+                    url = bypass(worker, payload, retry)
+                if url is None:
+                    break
+                if fetch(worker, worker.link, url):
+                    return True
+                break
+            except Retryable as error:
+                if not retry.wait(error):
+                    break
+    return False
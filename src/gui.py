@@ -1,16 +1,28 @@
 import sys
+import time
 import pickle
 import os
-import PyQt5.sip
-from workers import FilterWorker, DownloadWorker
-from PyQt5.QtCore import Qt, QThreadPool
-from PyQt5.QtGui import QIcon, QStandardItemModel, QStandardItem
+import threading
+import itertools
+from progress import BOARD, REFRESH_RATE
+from metadata import METADATA
+from journal import JOURNAL, FLUSH_INTERVAL
+from index import INDEX
+from model import DownloadTableModel, ProgressDelegate, PROGRESS_COLUMN
+from scheduler import Scheduler, MAX_ACTIVE
+from PyQt5.QtCore import Qt, QObject, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QGridLayout,
                              QPushButton, QWidget, QMessageBox,
                              QTableView, QHeaderView, QHBoxLayout,
                              QPlainTextEdit, QVBoxLayout, QAbstractItemView,
                              QAbstractScrollArea, QLabel, QLineEdit,
-                             QFileDialog, QProgressBar)
+                             QFileDialog, QSpinBox, QMenu)
+
+# Seconds from launch until the window is up, slower startups are reported on stdout.
+STARTUP_BUDGET = 0.5
+# Restored downloads added to the table per event loop pass.
+RESTORE_BATCH = 50
 
 # Absolute path
 def abs(f):
@@ -35,7 +47,7 @@ def check_selection(table):
         return selection
 '''
 Create empty file
-Used to create app/settings and app/cache.
+Used to create app/settings.
 '''
 def create_file(f):
     f = abs(f)
@@ -44,29 +56,28 @@ def create_file(f):
     f = open(f, 'x')
     f.close()
 
+class LoaderSignals(QObject):
+    # Journal records to restore, once the saved state is loaded.
+    loaded = pyqtSignal(list)
+
 class GuiBehavior:
     def __init__(self, gui):
         self.filter_thread = QThreadPool()
         self.download_thread = QThreadPool()
-        self.download_workers = []
+        self.scheduler = Scheduler(lambda worker: self.download_thread.start(worker.run))
+        # Every download with a row, by id (DownloadRecord.id).
+        self.downloads = {}
+        self.ids = itertools.count()
+        # Links queued or being resolved, to skip duplicates before any request.
+        self.queued_links = set()
+        self.queue_lock = threading.Lock()
         self.gui = gui
+        self.loader = threading.Thread(target=self.load_state, daemon=True)
+        self.loader_signals = LoaderSignals()
+        self.loader_signals.loaded.connect(self.restore)
         self.handle_init()
 
     def handle_init(self):
-        # Load cached downloads
-        try:
-            with open(abs('app/cache'), 'rb') as f:
-                self.cached_downloads = pickle.load(f)
-                for download in self.cached_downloads:
-                    self.gui.links = download[0]
-                    self.add_links(True, download)
-        except EOFError:
-            self.cached_downloads = []
-            print('No cached downloads.')
-        except FileNotFoundError:
-            self.cached_downloads = []
-            create_file('app/cache')
-        
         # Load settings
         try:
             with open(abs('app/settings'), 'rb') as f:
@@ -77,30 +88,97 @@ class GuiBehavior:
         except FileNotFoundError:
             self.settings = None
             create_file('app/settings')
-                
-    def resume_download(self):
+        self.apply_limits()
+
+    def load_state(self):
+        '''
+        Runs on the loader thread once the window is shown.
+        '''
+        # The heavy imports (requests, lxml), the main thread finds them loaded afterwards.
+        import workers
+        from proxies import POOL
+        # Load link metadata, restored downloads are resolved from it
+        METADATA.load(abs('app/metadata'))
+        # Known downloads per link, to skip or resume links added again
+        INDEX.load(abs('app/index'))
+
+        # Downloads to restore from the journal (and from the cache of older versions)
+        JOURNAL.open(abs('app/journal.db'))
+        if os.path.exists(abs('app/cache')):
+            JOURNAL.migrate(abs('app/cache'))
+        self.loader_signals.loaded.emit(JOURNAL.load())
+
+        # Load known proxies and top the pool up in the background
+        POOL.load(abs('app/proxies'))
+        POOL.prefetch()
+
+    def wait_state(self):
+        '''
+        Links added and exits before the state is loaded wait for it.
+        '''
+        if self.loader.is_alive():
+            self.loader.join()
+
+    def restore(self, downloads):
+        '''
+        Add RESTORE_BATCH restored downloads, the rest after the event loop has run.
+        '''
+        for download in downloads[:RESTORE_BATCH]:
+            self.add_links(True, download)
+        if len(downloads) > RESTORE_BATCH:
+            QTimer.singleShot(0, lambda: self.restore(downloads[RESTORE_BATCH:]))
+
+    def apply_limits(self):
+        '''
+        Settings: [download directory, max active downloads, bandwidth cap in KB/s (0 = none)]
+        '''
+        settings = self.settings or []
+        max_active = settings[1] if len(settings) > 1 else MAX_ACTIVE
+        rate = settings[2] * 1024 if len(settings) > 2 else 0
+        self.download_thread.setMaxThreadCount(max_active)
+        self.scheduler.set_limits(max_active=max_active, rate=rate)
+
+    def selected_downloads(self):
+        '''
+        Workers of the selected rows, in row order.
+        '''
         selected_rows = check_selection(self.gui.table)
-        if selected_rows:
-            for i in selected_rows:
-                if i < len(self.download_workers):
-                    self.download_workers[i].resume()
+        if not selected_rows:
+            return []
+        records = self.gui.table_model.records
+        return [self.downloads[records[i].id] for i in sorted(selected_rows)]
+
+    def move_download(self, top):
+        workers = self.selected_downloads()
+        for worker in reversed(workers) if top else workers:
+            self.scheduler.move(worker, top)
+
+    def resume_download(self):
+        for worker in self.selected_downloads():
+            worker.resume()
 
     def stop_download(self):
-        selected_rows = check_selection(self.gui.table)
-        if selected_rows:
-            for i in selected_rows:
-                if i < len(self.download_workers):
-                    self.download_workers[i].stop(i)
-                    self.download_workers.remove(self.download_workers[i])
+        workers = self.selected_downloads()
+        for worker in workers:
+            worker.stop()
+            del self.downloads[worker.id]
+        with self.queue_lock:
+            self.queued_links.difference_update(worker.link for worker in workers)
+        self.gui.table_model.remove([worker.record for worker in workers])
+        JOURNAL.sync(workers)
 
     def pause_download(self):
-        selected_rows = check_selection(self.gui.table)
-        if selected_rows:
-            for i in selected_rows:
-                if i < len(self.download_workers):
-                    self.download_workers[i].pause()
+        for worker in self.selected_downloads():
+            worker.pause()
+
+    def set_password(self, record):
+        worker = self.downloads.get(record.id)
+        if worker:
+            worker.control.set_password(record.password)
 
     def add_links(self, state, cached_download = ''):
+        from workers import FilterWorker
+        self.wait_state()
         worker = FilterWorker(self, cached_download)
 
         worker.signals.download_signal.connect(self.download_receive_signal)
@@ -108,30 +186,40 @@ class GuiBehavior:
         
         self.filter_thread.start(worker)
     
-    def download_receive_signal(self, row, link, append_row = True, dl_name = '', progress = 0):
-        if append_row:
-            self.gui.table_model.appendRow(row)
-            index = self.gui.table_model.index(self.gui.table_model.rowCount()-1, 4)
-            progress_bar = QProgressBar()
-            progress_bar.setValue(progress)
-            self.gui.table.setIndexWidget(index, progress_bar)
-            row[4] = progress_bar
-
-        worker = DownloadWorker(link, self.gui.table_model, row, self.settings, dl_name)
-        worker.signals.update_signal.connect(self.update_receive_signal)
-        worker.signals.unpause_signal.connect(self.download_receive_signal)
-
-        self.download_thread.start(worker)
-        self.download_workers.append(worker)
-
-    def update_receive_signal(self, data, items):
-        if data:
-            if not PyQt5.sip.isdeleted(data[2]):
-                for i in range(len(items)):
-                    if items[i] and isinstance(items[i], str): data[i].setText(items[i])
-                    if items[i] and not isinstance(items[i], str):
-                        data[i].setValue(items[i])
+    def download_receive_signal(self, record, link, dl_name = '', segments = None, hasher = None):
+        record.id = next(self.ids)
+        self.gui.table_model.append(record)
+
+        from workers import DownloadWorker
+        worker = DownloadWorker(record.id, link, record, self.settings, dl_name, segments, hasher)
+        worker.scheduler = self.scheduler
+        self.downloads[record.id] = worker
+        worker.queue()
+
+    def refresh_progress(self):
+        '''
+        Called by the GUI timer, applies every progress change since the last tick in one batch.
+        '''
+        changed = []
+        for worker, (name, size, status, speed, percent, eta) in BOARD.snapshot():
+            record = worker.record
+            if record.removed:
+                continue
+            if name: record.name = name
+            if size: record.size = size
+            if status: record.status = status
+            record.speed = f'{speed} ({eta})' if eta else speed
+            if percent is not None:
+                record.percent = int(percent)
+            changed.append(record)
+        self.gui.table_model.refresh(changed)
     
+    def save_journal(self):
+        '''
+        Called by the GUI timer, the journal writes what changed since the last call.
+        '''
+        JOURNAL.sync(self.downloads.values())
+
     def set_dl_directory(self):
         file_dialog = QFileDialog()
         file_dialog.setFileMode(QFileDialog.Directory)
@@ -142,35 +230,52 @@ class GuiBehavior:
         with open(abs('app/settings'), 'wb') as f:
             settings = []
             settings.append(self.gui.dl_directory_input.text())
+            settings.append(self.gui.max_active_input.value())
+            settings.append(self.gui.rate_limit_input.value())
             pickle.dump(settings, f)
             self.settings = settings
+        self.apply_limits()
         self.gui.settings.hide()
         
 
     def handle_exit(self):
-        active_downloads = []
-        for w in self.download_workers:
-            download = w.return_data()
-            if download: active_downloads.append(download)
-        active_downloads.extend(self.cached_downloads)
-
-        with open(abs('app/cache'), 'wb') as f:
-            if active_downloads:
-                pickle.dump(active_downloads, f)
+        from proxies import POOL
+        self.wait_state()
+        JOURNAL.sync(self.downloads.values())
+        JOURNAL.close()
+
+        POOL.save()
+        METADATA.save()
+        INDEX.save()
         
         os._exit(1)
 
 class Gui:
-    def __init__(self):
-        self.actions = GuiBehavior(self)
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
         app = QApplication(sys.argv)
+        self.actions = GuiBehavior(self)
         app.setWindowIcon(QIcon(abs('ico.ico')))
         app.setStyle('Fusion')
         app.aboutToQuit.connect(self.actions.handle_exit)
+        self.refresh_timer = QTimer()
+        self.refresh_timer.timeout.connect(self.actions.refresh_progress)
+        self.refresh_timer.start(1000 // REFRESH_RATE)
+        self.journal_timer = QTimer()
+        self.journal_timer.timeout.connect(self.actions.save_journal)
+        self.journal_timer.start(1000 * FLUSH_INTERVAL)
         self.main_win()
         self.add_links_win()
         self.settings_win()
+        # Runs once the event loop has shown the window.
+        QTimer.singleShot(0, self.shown)
         sys.exit(app.exec_())
+
+    def shown(self):
+        elapsed = time.perf_counter() - self.started
+        if elapsed > STARTUP_BUDGET:
+            print(f'Window shown after {elapsed:.2f} s, over the {STARTUP_BUDGET} s budget.')
+        self.actions.loader.start()
     
     def main_win(self):
         self.main = QMainWindow()
@@ -189,15 +294,17 @@ class Gui:
 
         # Table
         self.table = QTableView()
-        headers = ['Name', 'Size', 'Status', 'Down Speed', 'Progress', 'Password']
         self.table.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContentsOnFirstShow)
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.table.verticalHeader().hide()
+        self.table.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.table.customContextMenuRequested.connect(self.table_menu)
 
-        self.table_model = QStandardItemModel()
-        self.table_model.setHorizontalHeaderLabels(headers)
+        self.table_model = DownloadTableModel()
         self.table.setModel(self.table_model)
+        self.table_model.password_changed.connect(self.actions.set_password)
+        self.table.setItemDelegateForColumn(PROGRESS_COLUMN, ProgressDelegate(self.table))
 
         # Append widgets to grid
         grid.addWidget(download_btn, 0, 0)
@@ -230,6 +337,12 @@ class Gui:
         self.main.resize(670, 415)
         self.main.show()
     
+    def table_menu(self, pos):
+        menu = QMenu(self.table)
+        menu.addAction('Move to top', lambda: self.actions.move_download(True))
+        menu.addAction('Move to bottom', lambda: self.actions.move_download(False))
+        menu.exec_(self.table.viewport().mapToGlobal(pos))
+
     def add_links_win(self):
         self.add_links = QMainWindow(self.main)
         self.add_links.setWindowTitle('Add Link(s)')
@@ -240,6 +353,7 @@ class Gui:
 
         # Text Edit
         self.links = QPlainTextEdit()
+        self.links.setPlaceholderText('One link per line, optionally followed by its checksum (sha256:...)')
         layout.addWidget(self.links)
 
         # Add Button
@@ -273,13 +387,31 @@ class Gui:
         hbox.addWidget(dl_directory_btn)
         hbox.addWidget(self.dl_directory_input)
 
+        settings = self.actions.settings or []
+
+        # Limits
+        limits = QGridLayout()
+        self.max_active_input = QSpinBox()
+        self.max_active_input.setRange(1, 50)
+        self.max_active_input.setValue(settings[1] if len(settings) > 1 else MAX_ACTIVE)
+        self.rate_limit_input = QSpinBox()
+        self.rate_limit_input.setRange(0, 10 ** 6)
+        self.rate_limit_input.setSuffix(' KB/s')
+        self.rate_limit_input.setSpecialValueText('Unlimited')
+        self.rate_limit_input.setValue(settings[2] if len(settings) > 2 else 0)
+        limits.addWidget(QLabel('Simultaneous downloads:'), 0, 0)
+        limits.addWidget(self.max_active_input, 0, 1)
+        limits.addWidget(QLabel('Bandwidth limit:'), 1, 0)
+        limits.addWidget(self.rate_limit_input, 1, 1)
+
         save_settings = QPushButton('Save Settings')
         save_settings.clicked.connect(self.actions.save_settings)
 
         vbox.addWidget(dl_directory_label)
         vbox.addLayout(hbox)
+        vbox.addLayout(limits)
         vbox.addWidget(save_settings)
 
         self.add_links.setMinimumSize(300, 200)
         widget.setLayout(vbox)
-        self.settings.setFixedSize(340, 85)
\ No newline at end of file
+        self.settings.setFixedSize(self.settings.sizeHint())
\ No newline at end of file
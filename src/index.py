@@ -0,0 +1,119 @@
+import os
+import pickle
+import threading
+from metadata import normalize
+
+class DownloadIndex:
+    '''
+    Downloads by link, and the names taken in each download directory.
+    Finds a link that is already downloaded (or half downloaded) in a directory,
+    and picks free '(i) name' names without probing the directory once per candidate.
+    A directory is listed once, the first time a name is picked in it.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        # normalized link: [directory, name, size, segments, complete]
+        self.links = {}
+        # directory: names in use, without .unfinished
+        self.names = {}
+        # (directory, name): next i to try for '(i) name'
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def load(self, path):
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                links = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return
+        with self.lock:
+            self.links.update(links)
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            links = {link: list(entry) for link, entry in self.links.items()}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as f:
+            pickle.dump(links, f)
+
+    def taken(self, directory):
+        names = self.names.get(directory)
+        if names is None:
+            names = self.names[directory] = set()
+            try:
+                for entry in os.scandir(directory):
+                    names.add(entry.name[:-11] if entry.name.endswith('.unfinished') else entry.name)
+            except FileNotFoundError:
+                pass
+        return names
+
+    def find(self, link, directory):
+        '''
+        (name, segments, complete) of `link` in `directory` if its file is still there, else None.
+        '''
+        directory = os.path.abspath(directory)
+        with self.lock:
+            entry = self.links.get(normalize(link))
+        if entry is None or entry[0] != directory:
+            return None
+        name = entry[1] if entry[4] else f'{entry[1]}.unfinished'
+        if not os.path.isfile(os.path.join(directory, name)):
+            return None
+        return name, entry[3], entry[4]
+
+    def reserve(self, link, directory, name, size=None):
+        '''
+        Pick `name` or the first free '(i) name' for `link` and create its .unfinished file.
+        Returns None instead when `name` is already a complete file of the same size.
+        '''
+        directory = os.path.abspath(directory)
+        with self.lock:
+            taken = self.taken(directory)
+            path = os.path.join(directory, name)
+            if size and name in taken and os.path.isfile(path) and os.path.getsize(path) == size:
+                self.links[normalize(link)] = [directory, name, size, None, True]
+                return None
+
+            candidate = name
+            i = self.counters.get((directory, name), 1)
+            # Files created since the directory was listed are caught by the exists checks.
+            while candidate in taken or os.path.exists(os.path.join(directory, candidate)) \
+                    or os.path.exists(os.path.join(directory, f'{candidate}.unfinished')):
+                taken.add(candidate)
+                candidate = f'({i}) {name}'
+                i += 1
+            self.counters[(directory, name)] = i
+            taken.add(candidate)
+            open(os.path.join(directory, f'{candidate}.unfinished'), 'ab').close()
+            self.links[normalize(link)] = [directory, candidate, size, None, False]
+        return candidate
+
+    def track(self, link, segments):
+        '''
+        Keep the range map of an unfinished download, so re-adding its link resumes it.
+        '''
+        with self.lock:
+            entry = self.links.get(normalize(link))
+            if entry is not None:
+                entry[3] = segments
+
+    def complete(self, link):
+        with self.lock:
+            entry = self.links.get(normalize(link))
+            if entry is not None:
+                entry[3] = None
+                entry[4] = True
+
+    def discard(self, link):
+        '''
+        Forget a download whose file was removed.
+        '''
+        with self.lock:
+            entry = self.links.pop(normalize(link), None)
+            if entry is not None and entry[0] in self.names:
+                self.names[entry[0]].discard(entry[1])
+
+INDEX = DownloadIndex()
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import threading
+
+# Seconds between journal commits, every change made in between is written with one fsync.
+FLUSH_INTERVAL = 1
+
+class Journal:
+    '''
+    Crash-safe download queue, one SQLite row per download keyed by link.
+    Records have the DownloadWorker.return_data format:
+    [link, dl_name, password, progress percent, segments, checksum], plus the byte offset reached.
+    sync() only queues what changed since the last call, a writer thread commits the
+    queued changes in one transaction every FLUSH_INTERVAL seconds.
+    '''
+    def __init__(self, path=None, interval=FLUSH_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.db = None
+        self.written = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.closed = False
+
+    def open(self, path=None):
+        self.path = path or self.path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS downloads ('
+                        'link TEXT PRIMARY KEY, name TEXT, password TEXT, progress INTEGER, '
+                        'offset INTEGER, segments TEXT, checksum TEXT)')
+        try:
+            # Journals written before checksums were kept.
+            self.db.execute('ALTER TABLE downloads ADD COLUMN checksum TEXT')
+        except sqlite3.OperationalError:
+            pass
+        threading.Thread(target=self.writer, daemon=True).start()
+
+    def load(self):
+        '''
+        Restored records in the order they were first added.
+        '''
+        records = []
+        for link, name, password, progress, offset, segments, checksum in self.db.execute(
+                'SELECT link, name, password, progress, offset, segments, checksum FROM downloads ORDER BY rowid'):
+            record = [link, name, password, progress, json.loads(segments) if segments else None, checksum]
+            self.written[link] = (record, offset)
+            records.append(record)
+        return records
+
+    def migrate(self, path):
+        '''
+        Import the downloads of an old pickle cache, the file is removed afterwards.
+        '''
+        try:
+            with open(path, 'rb') as f:
+                cached = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            cached = []
+        for record in cached:
+            self.put(record[:4] + [record[4] if len(record) > 4 else None, None], 0)
+        self.flush()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def put(self, record, offset=0):
+        with self.lock:
+            self.pending[record[0]] = (record, offset)
+            self.wake.notify()
+
+    def remove(self, link):
+        with self.lock:
+            self.pending[link] = None
+            self.wake.notify()
+
+    def sync(self, workers):
+        '''
+        Queue the state of every worker that changed since the last sync.
+        Finished and removed workers have no record and are dropped from the journal.
+        '''
+        for worker in workers:
+            record = worker.return_data()
+            if record is None:
+                if worker.link in self.written:
+                    del self.written[worker.link]
+                    self.remove(worker.link)
+                continue
+            # Copy the segments, download threads keep updating them in place.
+            record[4] = [list(s) for s in record[4]] if record[4] else None
+            state = (record, worker.progress.downloaded)
+            if self.written.get(worker.link) != state:
+                self.written[worker.link] = state
+                self.put(*state)
+
+    def writer(self):
+        while True:
+            with self.wake:
+                while not self.pending and not self.closed:
+                    self.wake.wait()
+                if self.closed:
+                    return
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        with self.db_lock:
+            if self.db is None:
+                return
+            self.db.execute('BEGIN')
+            try:
+                self.write(pending)
+            except sqlite3.Error:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def write(self, pending):
+        for link, state in pending.items():
+            if state is None:
+                self.db.execute('DELETE FROM downloads WHERE link = ?', (link,))
+                continue
+            (link, name, password, progress, segments, checksum), offset = state
+            self.db.execute('INSERT INTO downloads (link, name, password, progress, offset, segments, checksum) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(link) DO UPDATE SET '
+                            'name = excluded.name, password = excluded.password, progress = excluded.progress, '
+                            'offset = excluded.offset, segments = excluded.segments, checksum = excluded.checksum',
+                            (link, name, password, progress, offset, json.dumps(segments) if segments else None,
+                             checksum))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wake.notify()
+        self.flush()
+        with self.db_lock:
+            # Never opened when the GUI closes before its state is loaded.
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+JOURNAL = Journal()
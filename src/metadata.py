@@ -0,0 +1,82 @@
+import os
+import time
+import pickle
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+# Entries older than METADATA_TTL seconds are refetched, past MAX_ENTRIES the least recently used go first.
+METADATA_TTL = 24 * 60 * 60
+MAX_ENTRIES = 20000
+
+def normalize(link):
+    '''
+    Cache key of a link: https, lowercase host, no affiliate parameter, fragment or trailing slash.
+    '''
+    link = link.strip()
+    if '://' not in link:
+        link = f'https://{link}'
+    link = link.split('&af=')[0]
+    scheme, netloc, path, query, _ = urlsplit(link)
+    if scheme == 'http' and netloc.lower().endswith('1fichier.com'):
+        scheme = 'https'
+    return urlunsplit((scheme, netloc.lower(), path.rstrip('/') or '/', query, ''))
+
+class MetadataCache:
+    '''
+    Link metadata (name, size, password flag) and folder listings, kept on disk
+    so re-added and restored links need no request.
+    '''
+    def __init__(self, path=None, ttl=METADATA_TTL, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, path):
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                entries = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return
+        now = time.time()
+        with self.lock:
+            for key, (stamp, value) in entries.items():
+                if now - stamp < self.ttl:
+                    self.entries[key] = (stamp, value)
+            self.evict()
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            entries = OrderedDict(self.entries)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as f:
+            pickle.dump(entries, f)
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, link):
+        key = normalize(link)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] >= self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, link, value):
+        with self.lock:
+            self.entries[normalize(link)] = (time.time(), value)
+            self.entries.move_to_end(normalize(link))
+            self.evict()
+
+METADATA = MetadataCache()
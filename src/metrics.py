@@ -0,0 +1,159 @@
+import os
+import re
+import json
+import time
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Prefix of the exported metric names.
+PREFIX = 'fichier_dl'
+# cProfile dumps of every download go to PROFILE_DIR (None = off), set by --profile or the environment.
+PROFILE_DIR = os.environ.get('FICHIER_DL_PROFILE') or None
+
+def label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+class Metrics:
+    '''
+    Process-wide counters and timings, updated from any thread.
+    A metric is a name plus optional labels, e.g. inc('retries', kind='proxy').
+    span() times a block: its count, total and longest time are kept per name.
+    '''
+    def __init__(self):
+        self.counters = Counter()
+        # (name, labels): [count, total seconds, longest seconds]
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += n
+
+    def get(self, name, **labels):
+        with self.lock:
+            return self.counters[(name, tuple(sorted(labels.items())))]
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = [0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    @contextmanager
+    def span(self, name, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t, **labels)
+
+    def snapshot(self):
+        '''
+        {(name, ((label, value), ...)): count} of every counter.
+        '''
+        with self.lock:
+            return dict(self.counters)
+
+    def to_json(self):
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            spans = [{'name': name, 'labels': dict(labels), 'count': count,
+                      'seconds': round(total, 6), 'max': round(longest, 6)}
+                     for (name, labels), (count, total, longest) in sorted(self.timings.items())]
+        return {'time': time.time(), 'counters': counters, 'spans': spans}
+
+    def prometheus(self):
+        '''
+        Prometheus text format: counters as <name>_total, spans as <name>_seconds summaries.
+        '''
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timings = sorted(self.timings.items())
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f'{PREFIX}_{name}_total'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{label_text(labels)} {value}')
+        for (name, labels), (count, total, longest) in timings:
+            metric = f'{PREFIX}_{name}_seconds'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} summary')
+            lines.append(f'{metric}_count{label_text(labels)} {count}')
+            lines.append(f'{metric}_sum{label_text(labels)} {total:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f, indent=1)
+
+    def serve(self, port, host='127.0.0.1'):
+        '''
+        Serve /metrics (Prometheus) and /metrics.json from a background thread.
+        '''
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, kind = metrics.prometheus().encode(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, kind = json.dumps(metrics.to_json()).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', kind)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+METRICS = Metrics()
+
+@contextmanager
+def profile(worker, part='download'):
+    '''
+    cProfile the calling thread while the block runs if PROFILE_DIR is set, the stats are
+    written to PROFILE_DIR/<file name>.<part>.prof (read them with pstats or snakeviz).
+    Python 3.12+ runs one cProfile at a time, parts that start while another runs are skipped.
+    '''
+    if not PROFILE_DIR:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        name = (worker.dl_name or worker.link).removesuffix('.unfinished')
+        name = re.sub(r'[^\w.()-]+', '_', name)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f'{name}.{part}.prof'))
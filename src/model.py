@@ -0,0 +1,141 @@
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt5.QtWidgets import QApplication, QStyle, QStyledItemDelegate, QStyleOptionProgressBar
+
+COLUMNS = ['Name', 'Size', 'Status', 'Down Speed', 'Progress', 'Password']
+PROGRESS_COLUMN = 4
+PASSWORD_COLUMN = 5
+
+def runs(rows):
+    '''
+    (first, last) of every run of consecutive numbers in sorted `rows`.
+    '''
+    first = None
+    for n, row in enumerate(rows):
+        if first is None:
+            first = row
+        if n + 1 == len(rows) or rows[n + 1] != row + 1:
+            yield first, row
+            first = None
+
+class DownloadRecord:
+    '''
+    One row of the download table. `password` is None for public files,
+    `id` is the key of its download in the GUI's registry.
+    '''
+    __slots__ = ('id', 'name', 'size', 'status', 'speed', 'percent', 'password', 'removed')
+
+    def __init__(self, name, size, password=None, percent=0):
+        self.id = None
+        self.name = name
+        self.size = size
+        self.status = 'Added'
+        self.speed = '0 B/s'
+        self.percent = percent or 0
+        self.password = password
+        self.removed = False
+
+class DownloadTableModel(QAbstractTableModel):
+    '''
+    Table of DownloadRecords. Views only ask for the rows they show,
+    refresh() reports the rows changed by one progress tick in contiguous ranges.
+    '''
+    # Record whose password cell was edited.
+    password_changed = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.rows = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.records)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        record = self.records[index.row()]
+        column = index.column()
+        if column == 0:
+            return record.name
+        if column == 1:
+            return record.size
+        if column == 2:
+            return record.status
+        if column == 3:
+            return record.speed
+        if column == PROGRESS_COLUMN:
+            return record.percent
+        return 'No password' if record.password is None else record.password
+
+    def flags(self, index):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() == PASSWORD_COLUMN and self.records[index.row()].password is not None:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        record = self.records[index.row()]
+        if role != Qt.EditRole or index.column() != PASSWORD_COLUMN or record.password is None:
+            return False
+        record.password = value
+        self.dataChanged.emit(index, index)
+        self.password_changed.emit(record)
+        return True
+
+    def append(self, record):
+        row = len(self.records)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.records.append(record)
+        self.rows[record] = row
+        self.endInsertRows()
+
+    def remove(self, records):
+        '''
+        Remove many rows at once: one removal per run of adjacent rows, row numbers
+        are only renumbered once, from the first removed row on.
+        '''
+        rows = sorted(self.rows.pop(r) for r in records if r in self.rows)
+        if not rows:
+            return
+        for record in records:
+            record.removed = True
+        for first, last in reversed(list(runs(rows))):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.records[first:last + 1]
+            self.endRemoveRows()
+        for i in range(rows[0], len(self.records)):
+            self.rows[self.records[i]] = i
+
+    def refresh(self, records):
+        '''
+        One dataChanged per run of adjacent changed rows.
+        '''
+        last = len(COLUMNS) - 1
+        for first, end in runs(sorted(self.rows[r] for r in records if r in self.rows)):
+            self.dataChanged.emit(self.index(first, 0), self.index(end, last))
+
+class ProgressDelegate(QStyledItemDelegate):
+    '''
+    Paints the progress column as a progress bar, no widget per row.
+    '''
+    def paint(self, painter, option, index):
+        style = option.widget.style() if option.widget else QApplication.style()
+        # Selection background first, like the other cells.
+        style.drawPrimitive(QStyle.PE_PanelItemViewItem, option, painter, option.widget)
+        bar = QStyleOptionProgressBar()
+        bar.rect = option.rect.adjusted(1, 1, -1, -1)
+        bar.state = QStyle.State_Enabled | QStyle.State_Horizontal
+        bar.minimum = 0
+        bar.maximum = 100
+        bar.progress = int(index.data() or 0)
+        bar.text = f'{bar.progress}%'
+        bar.textVisible = True
+        bar.textAlignment = Qt.AlignCenter
+        style.drawControl(QStyle.CE_ProgressBar, bar, painter, option.widget)
@@ -0,0 +1,64 @@
+import re
+from html import unescape
+from lxml import etree
+
+# XPath compiled once instead of on every page.
+DIRECT_LINK = etree.XPath('/html/body/div[4]/div[2]/a')
+# Regexes on the raw page: the password form is an element with id="pass", direct links point to a
+# download server (e.g. https://a-5.1fichier.com/c123456789), other 1fichier links don't have that form.
+# Both start with a literal so re can skip ahead to it, a direct link they miss still goes through DIRECT_LINK.
+PASSWORD_RE = re.compile(rb'''id=["']?pass["'\s/>]''')
+DIRECT_LINK_RE = re.compile(rb'''href=["'](https?://[\w-]+\.1fichier\.com/c\d+[^"'\s]*)["']''')
+PRIVATE_INFO = ['Private File', '- MB']
+
+def password_form(content):
+    '''
+    True if the page asks for the file's password.
+    '''
+    return bool(PASSWORD_RE.search(content))
+
+def direct_link(content):
+    '''
+    Direct link of the page answering the download form, None if it has none.
+    '''
+    m = DIRECT_LINK_RE.search(content)
+    if m:
+        return unescape(m.group(1).decode())
+    try:
+        html = etree.HTML(content)
+    except etree.LxmlError:
+        return None
+    # None for an empty page.
+    links = DIRECT_LINK(html) if html is not None else []
+    return links[0].get('href') if links else None
+
+def link_info(chunks):
+    '''
+    [name, size] from the first and third td.normal cells of a file page, PRIVATE_INFO if it asks
+    for a password, None if it has neither. `chunks` is the page as an iterable of bytes, parsing
+    stops at whichever comes first (password protected pages don't show the file).
+    '''
+    # The password field is an <input>, no other element is looked at.
+    parser = etree.HTMLPullParser(events=('end',), tag=('td', 'input'))
+    cells = []
+
+    def scan():
+        for _, element in parser.read_events():
+            if element.get('id') == 'pass':
+                return PRIVATE_INFO
+            if element.tag == 'td' and element.get('class') == 'normal':
+                cells.append(element.text)
+                if len(cells) == 3:
+                    return [cells[0], cells[2]]
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        info = scan()
+        if info is not None:
+            return list(info)
+    try:
+        parser.close()
+    except etree.LxmlError:
+        return None
+    info = scan()
+    return list(info) if info is not None else None
@@ -0,0 +1,113 @@
+import math
+import time
+import threading
+from collections import deque
+
+# Snapshot rate of the GUI timer and the span (seconds) the speed is averaged over.
+REFRESH_RATE = 5
+SPEED_WINDOW = 5
+
+def format_speed(bps):
+    if bps <= 0:
+        return '0 B/s'
+    size_name = ('B/s', 'KB/s', 'MB/s', 'GB/s', 'TB/s')
+    i = min(int(math.floor(math.log(bps, 1024))), len(size_name) - 1)
+    s = round(bps / math.pow(1024, i), 2)
+    return '%s %s' % (s, size_name[i])
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return '%d:%02d' % (seconds // 60, seconds % 60)
+
+class Progress:
+    '''
+    Progress slot of one download.
+    Only its worker writes to it, the board reads it, so no locking is needed:
+    plain attribute writes are enough and every change bumps `version`.
+    '''
+    __slots__ = ('name', 'size', 'status', 'downloaded', 'total',
+                 'version', 'closed', 'seen', 'samples')
+
+    def __init__(self):
+        self.name = self.size = self.status = None
+        self.downloaded = self.total = 0
+        self.version = 1
+        self.closed = False
+        # Reader side: last version delivered and (time, downloaded) samples.
+        self.seen = 0
+        self.samples = deque(maxlen=SPEED_WINDOW * REFRESH_RATE + 1)
+
+    def set(self, name=None, size=None, status=None):
+        if name is not None:
+            self.name = name
+        if size is not None:
+            self.size = size
+        if status is not None:
+            if status != self.status:
+                # New phase, the speed window starts over.
+                self.samples = deque(maxlen=self.samples.maxlen)
+            self.status = status
+        self.version += 1
+
+    def close(self):
+        self.closed = True
+        self.version += 1
+
+class ProgressBoard:
+    '''
+    Collects the progress slots of all downloads.
+    Workers update their slot as often as they like, a single consumer calls
+    snapshot() at REFRESH_RATE and gets one batch with what changed since.
+    '''
+    def __init__(self):
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def open(self, key):
+        slot = Progress()
+        with self.lock:
+            self.slots[key] = slot
+        return slot
+
+    def snapshot(self):
+        '''
+        Returns [(key, (name, size, status, speed, percent, eta)), ...] for every
+        slot that changed since the last call. Speed and ETA come from the
+        downloaded byte counts sampled over the last SPEED_WINDOW seconds.
+        '''
+        now = time.monotonic()
+        with self.lock:
+            slots = list(self.slots.items())
+
+        changes = []
+        for key, slot in slots:
+            samples = slot.samples
+            downloaded = slot.downloaded
+            moving = not samples or samples[-1][1] != downloaded or samples[0][1] != downloaded
+            samples.append((now, downloaded))
+
+            if slot.version == slot.seen and not moving:
+                continue
+            slot.seen = slot.version
+
+            speed = 0
+            if len(samples) > 1 and now > samples[0][0]:
+                speed = (downloaded - samples[0][1]) / (now - samples[0][0])
+            percent = eta = None
+            if slot.total:
+                percent = round(100 * downloaded / slot.total, 1)
+                if speed > 0:
+                    eta = format_eta((slot.total - downloaded) / speed)
+            changes.append((key, (slot.name, slot.size, slot.status, format_speed(speed), percent, eta)))
+
+            if slot.closed:
+                with self.lock:
+                    # The key may have opened a new slot meanwhile.
+                    if self.slots.get(key) is slot:
+                        del self.slots[key]
+
+        return changes
+
+BOARD = ProgressBoard()
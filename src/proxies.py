@@ -0,0 +1,164 @@
+import os
+import time
+import pickle
+import threading
+import sessions
+from random import choice
+from retry import BREAKERS
+from metrics import METRICS
+from concurrent.futures import ThreadPoolExecutor
+
+PROXY_LIST_API = 'https://www.proxyscan.io/api/proxy?type=https&format=txt&limit=20'
+CHECK_URL = 'https://1fichier.com/'
+CHECK_TIMEOUT = 5
+CHECK_WORKERS = 10
+# Prefetch below LOW_WATERMARK usable proxies, pick among the TOP best ones.
+LOW_WATERMARK = 5
+TOP = 3
+# Forget proxies not seen working for PROXY_TTL seconds or failing MAX_FAILURES times in a row.
+PROXY_TTL = 6 * 60 * 60
+MAX_FAILURES = 3
+
+class Proxy:
+    __slots__ = ('address', 'successes', 'failures', 'streak', 'latency', 'last_ok')
+
+    def __init__(self, address):
+        self.address = address
+        self.successes = self.failures = self.streak = 0
+        self.latency = None
+        self.last_ok = 0
+
+    def score(self):
+        # Laplace smoothed success rate per second of latency, untested proxies rank last.
+        if self.latency is None:
+            return 0
+        return (self.successes + 1) / (self.successes + self.failures + 2) / max(self.latency, 0.01)
+
+class ProxyPool:
+    '''
+    Proxies fetched in bulk, validated concurrently and scored by success rate and latency.
+    Working proxies are shared by all downloads and kept across sessions in `path`.
+    '''
+    def __init__(self, path=None, api=PROXY_LIST_API, check_url=CHECK_URL):
+        self.path = path
+        self.api = api
+        self.check_url = check_url
+        self.proxies = {}
+        self.lock = threading.Lock()
+        self.refilling = threading.Lock()
+
+    def load(self, path):
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                proxies = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return
+        now = time.time()
+        with self.lock:
+            for p in proxies:
+                if now - p.last_ok < PROXY_TTL:
+                    self.proxies.setdefault(p.address, p)
+
+    def save(self):
+        if not self.path:
+            return
+        now = time.time()
+        with self.lock:
+            proxies = [p for p in self.proxies.values() if now - p.last_ok < PROXY_TTL]
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as f:
+            pickle.dump(proxies, f)
+
+    def usable(self):
+        with self.lock:
+            return sorted((p for p in self.proxies.values() if p.latency is not None),
+                          key=Proxy.score, reverse=True)
+
+    def get(self, exclude=()):
+        '''
+        Return the address of one of the best proxies, refilling the pool first if it is empty.
+        Proxies benched by the circuit breaker are skipped. Raises LookupError when no proxy could be found.
+        '''
+        with METRICS.span('get_proxy'):
+            return self.pick(exclude)
+
+    def pick(self, exclude):
+        best = [p for p in self.usable() if p.address not in exclude and BREAKERS.allow(p.address)]
+        if len(best) < LOW_WATERMARK:
+            if best:
+                self.prefetch()
+            else:
+                self.refill()
+                best = [p for p in self.usable() if p.address not in exclude and BREAKERS.allow(p.address)]
+        if not best:
+            raise LookupError('No working proxy found.')
+        return choice(best[:TOP]).address
+
+    def report(self, address, ok, latency=None):
+        METRICS.inc('proxy_requests', result='ok' if ok else 'failed')
+        with self.lock:
+            p = self.proxies.get(address)
+            if p is None:
+                return
+            if ok:
+                p.successes += 1
+                p.streak = 0
+                p.last_ok = time.time()
+                if latency is not None:
+                    p.latency = latency if p.latency is None else 0.7 * p.latency + 0.3 * latency
+            else:
+                p.failures += 1
+                p.streak += 1
+                if p.streak >= MAX_FAILURES:
+                    del self.proxies[address]
+                    sessions.close(address)
+
+    def fetch(self):
+        r = sessions.get(self.api, timeout=CHECK_TIMEOUT)
+        return [line.strip() for line in r.text.splitlines() if line.strip()]
+
+    def check(self, address):
+        try:
+            t = time.monotonic()
+            # Also warms up the proxy's session for the bypass that follows.
+            r = sessions.head(self.check_url, proxy=address, timeout=CHECK_TIMEOUT)
+            # A proxy refusing or failing to relay answers itself, e.g. 403 or 502.
+            r.raise_for_status()
+            return address, time.monotonic() - t
+        except:
+            sessions.close(address)
+            return address, None
+
+    def refill(self):
+        '''
+        Fetch a batch of proxies and validate the new ones concurrently.
+        Only one refill runs at a time, concurrent callers wait for it.
+        '''
+        if not self.refilling.acquire(blocking=False):
+            with self.refilling:
+                return
+        try:
+            try:
+                addresses = self.fetch()
+            except:
+                return
+            with self.lock:
+                addresses = [a for a in dict.fromkeys(addresses) if a not in self.proxies]
+            with ThreadPoolExecutor(CHECK_WORKERS) as executor:
+                for address, latency in executor.map(self.check, addresses):
+                    if latency is None:
+                        continue
+                    p = Proxy(address)
+                    p.latency = latency
+                    p.last_ok = time.time()
+                    with self.lock:
+                        self.proxies[address] = p
+        finally:
+            self.refilling.release()
+
+    def prefetch(self):
+        if not self.refilling.locked():
+            threading.Thread(target=self.refill, daemon=True).start()
+
+POOL = ProxyPool()
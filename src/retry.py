@@ -0,0 +1,114 @@
+import time
+import random
+import threading
+from metrics import METRICS
+
+# Error classes: (retries before the download gives up (None = no limit), base delay in seconds, status text).
+# The n-th retry of a class waits a random time up to min(MAX_DELAY, base * 2 ** (n - 1)) (full jitter).
+POLICIES = {
+    # Every proxy of a bypass race failed or is benched. A few minutes of failed races, a download
+    # that gives up is paused and can be resumed once proxies work again.
+    'proxy': (10, 0.5, 'No working proxy'),
+    # 1fichier or its download server answered 429/503.
+    'rate_limited': (8, 5, 'Rate limited'),
+    # The direct link answered without a file.
+    'no_file': (5, 2, 'No file served'),
+    # The download server could not be reached or a range broke off.
+    'network': (5, 2, 'Connection lost'),
+    # The file was deleted, no retry changes that.
+    'removed': (0, 0, 'File removed'),
+}
+MAX_DELAY = 60
+# Circuit breaker: a host or proxy failing BREAKER_THRESHOLD times in a row is skipped for
+# BREAKER_COOLDOWN seconds, then lets one request through again (one more failure opens it again).
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+
+class Retryable(Exception):
+    '''
+    Failure of class `kind` (see POLICIES), `delay` is the least time to wait before the next try.
+    '''
+    def __init__(self, kind, delay=None):
+        super().__init__(kind)
+        self.kind = kind
+        self.delay = delay
+
+class CircuitBreaker:
+    '''
+    Consecutive failures per key (a proxy address or a host name).
+    '''
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = {}
+        self.until = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        return self.remaining(key) <= 0
+
+    def remaining(self, key):
+        '''
+        Seconds until `key` may be used again.
+        '''
+        with self.lock:
+            return self.until.get(key, 0) - time.monotonic()
+
+    def success(self, key):
+        with self.lock:
+            self.failures.pop(key, None)
+            self.until.pop(key, None)
+
+    def failure(self, key, cooldown=None):
+        '''
+        Count a failure of `key`, a `cooldown` (e.g. a wait timer) opens the breaker right away.
+        '''
+        with self.lock:
+            n = self.failures[key] = self.failures.get(key, 0) + 1
+            if cooldown is None and n < self.threshold:
+                return
+            self.until[key] = time.monotonic() + (self.cooldown if cooldown is None else cooldown)
+        METRICS.inc('breaker_opened')
+
+BREAKERS = CircuitBreaker()
+
+class Retry:
+    '''
+    Retries of one download run, per error class.
+    The count of a class starts over once the download made progress since its last failure.
+    '''
+    def __init__(self, worker):
+        self.worker = worker
+        self.attempts = {}
+        self.marks = {}
+
+    def next(self, error):
+        '''
+        Delay before retrying after `error`, None when the download gives up.
+        Shows the decision in the status column.
+        '''
+        limit, base, label = POLICIES[error.kind]
+        downloaded = self.worker.progress.downloaded
+        if downloaded > self.marks.get(error.kind, downloaded):
+            self.attempts[error.kind] = 0
+        self.marks[error.kind] = downloaded
+        n = self.attempts[error.kind] = self.attempts.get(error.kind, 0) + 1
+        if limit is not None and n > limit:
+            METRICS.inc('gave_up', kind=error.kind)
+            self.worker.progress.set(status=label if not limit else f'{label}, gave up')
+            return None
+        METRICS.inc('retries', kind=error.kind)
+        delay = max(random.uniform(0, min(MAX_DELAY, base * 2 ** (n - 1))), error.delay or 0)
+        self.worker.progress.set(status=f'{label}, retry {n} in {delay:.0f} s')
+        return delay
+
+    def wait(self, error):
+        '''
+        Blocking version of next(): returns True once it is time to retry,
+        False if the download gives up or is paused or stopped meanwhile.
+        '''
+        delay = self.next(error)
+        return delay is not None and not self.worker.control.wait(delay)
+
+    def reset(self, kind):
+        self.attempts.pop(kind, None)
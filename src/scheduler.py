@@ -0,0 +1,162 @@
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+# Transfers running at once, bypasses running at once, global bandwidth cap in bytes/s (None = unlimited).
+MAX_ACTIVE = 3
+MAX_BYPASSING = 2
+GLOBAL_RATE = None
+
+class TokenBucket:
+    '''
+    Bandwidth cap: `rate` bytes/s with bursts up to one second worth of data.
+    '''
+    def __init__(self, rate=None):
+        self.lock = threading.Lock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate or None
+            self.tokens = self.rate or 0
+            self.stamp = time.monotonic()
+
+    def reserve(self, n):
+        '''
+        Take n tokens, going into debt if needed. Returns the seconds to wait before using them.
+        '''
+        with self.lock:
+            if not self.rate:
+                return 0
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+class Scheduler:
+    '''
+    Global download queue.
+    Jobs wait in priority order (then submission order) and at most `max_active` run at once;
+    `start(job)` is called to run one and the job must call finished(job) when it returns.
+    Jobs need `stopped` and `paused` attributes and a `control` (control.Control) to wake their waits,
+    an optional `rate_limit` (bytes/s) caps one job.
+    '''
+    def __init__(self, start, max_active=MAX_ACTIVE, max_bypassing=MAX_BYPASSING, rate=GLOBAL_RATE):
+        self.start = start
+        self.max_active = max_active
+        self.max_bypassing = max_bypassing
+        self.bucket = TokenBucket(rate)
+        self.buckets = {}
+        self.queue = {}
+        self.active = set()
+        self.bypassing_count = 0
+        self.counter = itertools.count()
+        self.lock = threading.RLock()
+        self.bypass_free = threading.Condition(self.lock)
+
+    def submit(self, job, priority=0):
+        with self.lock:
+            self.queue[job] = (-priority, next(self.counter))
+        self.promote()
+
+    def remove(self, job):
+        '''
+        Drop a job that has not started yet. Returns False if it is already running.
+        '''
+        with self.lock:
+            return self.queue.pop(job, None) is not None
+
+    def queued(self):
+        with self.lock:
+            return sorted(self.queue, key=self.queue.get)
+
+    def set_priority(self, job, priority):
+        with self.lock:
+            if job in self.queue:
+                self.queue[job] = (-priority, self.queue[job][1])
+
+    def move(self, job, top=True):
+        '''
+        Put a queued job in front of (or behind) every other queued job.
+        '''
+        with self.lock:
+            if job not in self.queue or len(self.queue) < 2:
+                return
+            keys = [k for j, k in self.queue.items() if j is not job]
+            order = min(keys)[0] - 1 if top else max(keys)[0] + 1
+            self.queue[job] = (order, next(self.counter))
+
+    def set_limits(self, max_active=None, max_bypassing=None, rate=None):
+        with self.lock:
+            if max_active is not None:
+                self.max_active = max_active
+            if max_bypassing is not None:
+                self.max_bypassing = max_bypassing
+                self.bypass_free.notify_all()
+        if rate is not None:
+            self.bucket.set_rate(rate)
+        self.promote()
+
+    def promote(self):
+        '''
+        Start queued jobs while there are free slots.
+        '''
+        while True:
+            with self.lock:
+                if len(self.active) >= self.max_active or not self.queue:
+                    return
+                job = min(self.queue, key=self.queue.get)
+                del self.queue[job]
+                self.active.add(job)
+            self.start(job)
+
+    def finished(self, job):
+        with self.lock:
+            self.active.discard(job)
+            self.buckets.pop(job, None)
+        self.promote()
+
+    @contextmanager
+    def bypassing(self, job):
+        '''
+        Hold one of the max_bypassing bypass slots, waiting for a free one.
+        '''
+        with job.control.on_halt(self.wake_bypassing):
+            with self.bypass_free:
+                while self.bypassing_count >= self.max_bypassing and not (job.stopped or job.paused):
+                    self.bypass_free.wait()
+                self.bypassing_count += 1
+        try:
+            yield
+        finally:
+            with self.bypass_free:
+                self.bypassing_count -= 1
+                self.bypass_free.notify()
+
+    def wake_bypassing(self):
+        with self.bypass_free:
+            self.bypass_free.notify_all()
+
+    def delay(self, job, n):
+        '''
+        Account for n transferred bytes, returns the seconds to wait for the global and the job's cap.
+        '''
+        wait = self.bucket.reserve(n)
+        rate = getattr(job, 'rate_limit', None)
+        if rate:
+            with self.lock:
+                bucket = self.buckets.get(job)
+                if bucket is None or bucket.rate != rate:
+                    bucket = self.buckets[job] = TokenBucket(rate)
+            wait = max(wait, bucket.reserve(n))
+        return wait
+
+    def throttle(self, job, n):
+        '''
+        Blocking version of delay(), sleeps until the bytes may be used.
+        '''
+        wait = self.delay(job, n)
+        if wait > 0:
+            job.control.wait(wait)
@@ -0,0 +1,62 @@
+import threading
+import requests
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+
+# Hosts kept per session, keep-alive connections kept per host, default (connect, read) timeout.
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 16
+TIMEOUT = (10, 30)
+# Proxy sessions kept open at once, least recently used ones are closed first.
+MAX_SESSIONS = 64
+
+_sessions = OrderedDict()
+_lock = threading.Lock()
+
+def proxy_dict(address):
+    # The list gives plain HTTP proxies, HTTPS goes through them with CONNECT.
+    # An https:// scheme would make urllib3 talk TLS to the proxy itself.
+    if '://' not in address:
+        address = f'http://{address}'
+    return {'http': address, 'https': address}
+
+def get_session(proxy=None):
+    '''
+    Shared keep-alive session for direct requests (proxy=None) or for one proxy.
+    Sessions are thread-safe for our use and pool their connections per host.
+    '''
+    with _lock:
+        s = _sessions.get(proxy)
+        if s is not None:
+            _sessions.move_to_end(proxy)
+            return s
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+        s.mount('http://', adapter)
+        s.mount('https://', adapter)
+        if proxy:
+            s.proxies.update(proxy_dict(proxy))
+        _sessions[proxy] = s
+        while len(_sessions) > MAX_SESSIONS:
+            key = next(k for k in _sessions if k is not None)
+            _sessions.pop(key).close()
+    return s
+
+def close(proxy=None):
+    with _lock:
+        s = _sessions.pop(proxy, None)
+    if s is not None:
+        s.close()
+
+def request(method, url, proxy=None, **kwargs):
+    kwargs.setdefault('timeout', TIMEOUT)
+    return get_session(proxy).request(method, url, **kwargs)
+
+def get(url, proxy=None, **kwargs):
+    return request('GET', url, proxy, **kwargs)
+
+def post(url, data=None, proxy=None, **kwargs):
+    return request('POST', url, proxy, data=data, **kwargs)
+
+def head(url, proxy=None, **kwargs):
+    return request('HEAD', url, proxy, **kwargs)
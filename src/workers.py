@@ -1,24 +1,80 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from download import *
-from PyQt5.QtCore import Qt, QObject, QRunnable, pyqtSignal, pyqtSlot
-from PyQt5.QtGui import QStandardItem
+from progress import BOARD
+from checksum import Hasher
+from index import INDEX
+from control import Control
+from model import DownloadRecord
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal, pyqtSlot
+
+# Links resolved at once when adding a batch.
+MAX_RESOLVERS = 8
 
 class WorkerSignals(QObject):
-    download_signal = pyqtSignal(list, str, bool, str, int)
+    download_signal = pyqtSignal(object, str, str, object, object)
     alert_signal = pyqtSignal(str)
-    update_signal = pyqtSignal(list, list)
-    unpause_signal = pyqtSignal(list, str, bool, str)
 
 class FilterWorker(QRunnable):
     def __init__(self, actions, cached_download = ''):
         super(FilterWorker, self).__init__()
-        self.links = actions.gui.links
-        self.cached_downloads = actions.cached_downloads
+        # A restored download brings its link, added links are read from the text box.
+        self.links = cached_download[0] if cached_download else actions.gui.links
         self.cached_download = cached_download
+        self.queued_links = actions.queued_links
+        self.queue_lock = actions.queue_lock
         self.signals = WorkerSignals()
         self.dl_name = cached_download[1] if self.cached_download else None
         self.password = cached_download[2] if self.cached_download else None
         self.progress = cached_download[3] if self.cached_download else None
+        self.segments = cached_download[4] if len(cached_download) > 4 else None
+        # Checksums given after the links, {link: 'algorithm:hex'}.
+        self.checksums = {cached_download[0]: cached_download[5]} if len(cached_download) > 5 else {}
+
+    def reserve(self, links):
+        '''
+        Drop duplicates and links that are already queued, then mark the rest as queued.
+        Done before any request so nothing is resolved twice.
+        '''
+        with self.queue_lock:
+            links = [link for link in dict.fromkeys(links) if link not in self.queued_links]
+            self.queued_links.update(links)
+        return links
+
+    def release(self, link):
+        with self.queue_lock:
+            self.queued_links.discard(link)
+
+    def resolve(self, link):
+        '''
+        Runs on the resolver pool, returns [(link, [name, size], password required), ...].
+        '''
+        if '/dir/' in link:
+            folder = get_folder_info(link)
+            if folder is None:
+                self.release(link)
+                return []
+            files = {f['link']: f for f in folder}
+            reserved = self.reserve(files)
+            # Its files are queued on their own, adding the folder again picks up the ones added since.
+            self.release(link)
+            return [(f['link'], [f['filename'], convert_size(int(f['size']))], f['password'] == 1)
+                    for f in map(files.get, reserved)]
+
+        info = get_link_info(link)
+        if info is None:
+            self.release(link)
+            return []
+        is_private = True if info[0] == 'Private File' else False
+        info[0] = self.dl_name if self.dl_name else info[0]
+        return [(link, info, is_private)]
+
+    def add_row(self, link, info, is_private):
+        record = DownloadRecord(info[0], info[1], (self.password or '') if is_private else None, self.progress)
+        checksum = self.checksums.get(link)
+        self.signals.download_signal.emit(record, link, self.dl_name, self.segments,
+                                          Hasher(checksum) if checksum else None)
 
     @pyqtSlot()
     def run(self):
@@ -27,117 +83,150 @@ class FilterWorker(QRunnable):
         if isinstance(self.links, str):
             self.valid_links = [self.links]
         else:
-            links = self.links.toPlainText().splitlines()
-
-            for link in links:
-                link = link.strip()
-                if '1fichier.com/' in link:
-                    if not 'https://' in link[0:8] and not 'http://' in link[0:7]:
-                        link = f'https://{link}'
-                    if '&af=' in link:
-                        link = link.split('&af=')[0]
-                    self.valid_links.append(link)
+            lines = parse_lines(self.links.toPlainText())
+            self.valid_links = [link for link, _ in lines]
+            self.checksums = {link: checksum for link, checksum in lines if checksum}
 
             if not self.valid_links:
                 self.signals.alert_signal.emit('The link(s) you inserted were not valid.')
 
-        for link in self.valid_links:
-            if '/dir/' in link:
-                folder = requests.get(f'{link}?json=1')
-                folder = folder.json()
-                for f in folder:
-                    link = f['link']
-                    info = [f['filename'], convert_size(int(f['size']))]
-                    info.extend(['Added', '0 B/s', ''])
-                    row = []
-
-                    for val in info:
-                        data = QStandardItem(val)
-                        data.setFlags(data.flags() & ~Qt.ItemIsEditable)
-                        row.append(data)
-
-                    if f['password'] == 1:
-                        password = QStandardItem()
-                        row.append(password)
-                    else:
-                        no_password = QStandardItem('No password')
-                        no_password.setFlags(data.flags() & ~Qt.ItemIsEditable)
-                        row.append(no_password)
-
-                    self.signals.download_signal.emit(row, link, True, self.dl_name, self.progress)
-                    if self.cached_download:
-                        self.cached_downloads.remove(self.cached_download)           
-            else:
-                info = get_link_info(link)
-                if info is not None:
-                    is_private = True if info[0] == 'Private File' else False
-                    info[0] = self.dl_name if self.dl_name else info[0]
-                    info.extend(['Added', '0 B/s', ''])
-                    row = []
-
-                    for val in info:
-                        data = QStandardItem(val)
-                        data.setFlags(data.flags() & ~Qt.ItemIsEditable)
-                        row.append(data)
-
-                    if is_private:
-                        password = QStandardItem(self.password)
-                        row.append(password)
-                    else:
-                        no_password = QStandardItem('No password')
-                        no_password.setFlags(data.flags() & ~Qt.ItemIsEditable)
-                        row.append(no_password)
-
-                    self.signals.download_signal.emit(row, link, True, self.dl_name, self.progress)
-                    if self.cached_download:
-                        self.cached_downloads.remove(self.cached_download)
-
-class DownloadWorker(QRunnable):
-    def __init__(self, link, table_model, data, settings, dl_name = ''):
-        super(DownloadWorker, self).__init__()
+        # Resolve concurrently, rows are added in the order results come in.
+        with ThreadPoolExecutor(MAX_RESOLVERS) as executor:
+            futures = [executor.submit(self.resolve, link) for link in self.reserve(self.valid_links)]
+            for future in as_completed(futures):
+                for link, info, is_private in future.result():
+                    self.add_row(link, info, is_private)
+
+class DownloadWorker:
+    '''
+    One download, registered by `id` for as long as its row exists.
+    The scheduler runs it on the download pool, a resumed download is queued again.
+    '''
+    def __init__(self, id, link, record, settings, dl_name = '', segments = None, hasher = None):
+        self.id = id
         self.link = link
-        self.table_model = table_model
-        self.data = data
-        self.signals = WorkerSignals()
-        self.paused = self.stopped = self.complete = False
+        self.record = record
+        self.progress = BOARD.open(self)
+        # Pause, stop and the password cell, a download waiting for a password is woken up by it.
+        self.control = Control(record.password, on_wake=self.wake)
+        self.complete = False
+        # Queued or running, `resumed` asks for another run once the current one has stopped.
+        self.running = self.resumed = False
+        self.lock = threading.Lock()
         self.dl_name = dl_name
-        self.dl_directory = settings[0] if settings else os.path.abspath(os.path.dirname(__file__))
+        # Per-range progress map of a segmented download, see download.split_segments.
+        self.segments = segments
+        # Running digest checked once the download completes, None when no checksum was given.
+        self.hasher = hasher
+        # Set by the GUI, the scheduler runs the worker and shapes its bandwidth (rate_limit in bytes/s).
+        self.scheduler = None
+        self.rate_limit = None
+        self.dl_directory = settings[0] if settings and settings[0] else os.path.abspath(os.path.dirname(__file__))
+
+    @property
+    def paused(self):
+        return self.control.paused
+
+    @property
+    def stopped(self):
+        return self.control.stopped
+
+    @property
+    def password(self):
+        # Password cell of the row, '' until the user types one.
+        return self.control.password
+
+    def queue(self):
+        self.running = True
+        if self.progress.closed:
+            self.progress = BOARD.open(self)
+        self.progress.set(status='Queued')
+        self.scheduler.submit(self)
 
-    @pyqtSlot()
     def run(self):
-        dl_name = download(self)
-        self.dl_name = dl_name
+        try:
+            complete = download(self)
+        except Exception as e:
+            # Handled like giving up below, so the scheduler slot is freed and the download can be resumed.
+            self.progress.set(status=f'Failed ({e})')
+            complete = False
+
+        requeue = False
+        try:
+            with self.lock:
+                if self.stopped:
+                    self.discard()
+                elif self.control.parked:
+                    # Waiting for a password, the status says which.
+                    pass
+                elif self.paused:
+                    self.progress.set(status='Paused')
+                elif complete:
+                    self.complete = True
+                    self.dl_name = None
+                else:
+                    # Gave up, the status says why. Paused, it can be resumed and stays in the journal.
+                    self.control.pause()
+                requeue = self.resumed and not (self.complete or self.stopped)
+                self.running = self.resumed = False
+        finally:
+            self.progress.close()
+            if self.scheduler:
+                self.scheduler.finished(self)
+        if requeue:
+            with self.lock:
+                self.queue()
+
+    def stop(self):
+        self.control.stop()
+        with self.lock:
+            # Queued or paused, no run() is left to remove the partial file.
+            if self.scheduler.remove(self) or not self.running:
+                self.progress.close()
+                self.discard()
+
+    def discard(self):
+        if not self.dl_name:
+            return
+        try:
+            os.remove(self.dl_directory + '/' + self.dl_name)
+        except:
+            print(f'Failed to remove: {self.dl_directory}/{self.dl_name}')
+        INDEX.discard(self.link)
 
-        if dl_name and self.stopped:
-            try:
-                os.remove(self.dl_directory + '/' + dl_name)
-            except:
-                print(f'Failed to remove: {self.dl_directory}/{dl_name}')
-
-        if self.paused:
-            self.signals.update_signal.emit(self.data, [None, None, 'Paused', '0 B/s'])
-        else:
-            if not dl_name:
-                self.complete = True
-
-    def stop(self, i):
-        self.table_model.removeRow(i)
-        self.stopped = True
-    
     def pause(self):
         if not self.complete:
-            self.paused = True
+            self.control.pause()
+            if self.scheduler.remove(self):
+                # Never started.
+                self.running = False
+                self.progress.set(status='Paused')
 
     def resume(self):
-        if self.paused == True:
-            self.paused = False
-            self.signals.unpause_signal.emit(self.data, self.link, False, self.dl_name)
+        if self.paused and not self.stopped:
+            self.control.resume()
+            self.wake()
+
+    def wake(self):
+        '''
+        Run again, after a pause or once a parked download got its password.
+        '''
+        with self.lock:
+            if self.stopped or self.complete:
+                return
+            if self.running:
+                # Still on its way out, run() queues it again.
+                self.resumed = True
+                return
+            self.queue()
     
     def return_data(self):
         if not self.stopped and not self.complete:
             data = []
             data.append(self.link)
             data.append(self.dl_name) if self.dl_name else data.append(None)
-            data.append(self.data[5].text()) if self.data[5].text() != 'No password' else data.append(None)
-            data.append(self.data[4].value())
+            data.append(self.record.password)
+            data.append(self.record.percent)
+            data.append(self.segments)
+            data.append(self.hasher.checksum if self.hasher else None)
             return data
\ No newline at end of file